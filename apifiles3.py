@@ -1,5 +1,10 @@
+import gzip
 import hashlib
 import logging
+import os
+import tempfile
+import threading
+import time
 
 import boto3
 from botocore.exceptions import ClientError
@@ -8,9 +13,12 @@ from config import (
     AWS_BUCKET_NAME,
     TARIC_FILES_FOLDER,
     TARIC_FILES_INDEX,
+    TARIC_JOBS_FOLDER,
     STREAM_CHUNK_SIZE,
     S3_ENDPOINT_URL,
+    UPLOAD_PART_SIZE,
 )
+from offload import offload
 
 logger = logging.getLogger("taricapi.files3")
 
@@ -42,15 +50,25 @@ def session():
 
 
 # generic file functions
-def modification_date(filepath):
-    response = session().get_object(Bucket=AWS_BUCKET_NAME, Key=filepath)
+def get_file_info(filepath):
+    """Return the modification date, size, ETag, last modified time and (if
+    recorded at upload) SHA-512 of filepath from a single HEAD request."""
+    response = session().head_object(Bucket=AWS_BUCKET_NAME, Key=filepath)
     md = response["Metadata"]
-    if "modified" in md:
-        modtime = md["modified"]
-    else:
-        modtime = response["LastModified"].isoformat()[:19]
-
-    return modtime
+    last_modified = response["LastModified"].isoformat()[:19]
+
+    return {
+        "modified": md.get("modified", last_modified),
+        "size": response["ContentLength"],
+        "etag": response["ETag"],
+        "last_modified": last_modified,
+        # only recorded for files uploaded since checksums were kept as metadata
+        "sha512": (
+            md.get("sha512")
+            if md.get("size") == str(response["ContentLength"])
+            else None
+        ),
+    }
 
 
 def find(list_, key, value):
@@ -62,14 +80,15 @@ def find(list_, key, value):
 
 def file_exists(filename):
     try:
-        session().get_object(Bucket=AWS_BUCKET_NAME, Key=filename)
+        session().head_object(Bucket=AWS_BUCKET_NAME, Key=filename)
         return True
 
-    except session().exceptions.NoSuchKey:
-        return False
-
     except ClientError as e:
-        logger.error("Error occurred in get_object for %s: %s", filename, e)
+        # HEAD responses have no body, so a missing key is reported as a bare 404
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return False
+
+        logger.error("Error occurred in head_object for %s: %s", filename, e)
         return None
 
 
@@ -83,15 +102,282 @@ def get_file(filepath):
         return None
 
 
-def get_file_size(filepath):
+def open_file(filepath, **kwargs):
+    """Open filepath with a single GET, returning the get_object response
+    (body, size, ETag, last modified time) or None if it does not exist.
+    kwargs are passed to get_object, e.g. Range="bytes=0-99"."""
     try:
-        response = session().get_object(Bucket=AWS_BUCKET_NAME, Key=filepath)
-        return response["ContentLength"]
+        return session().get_object(Bucket=AWS_BUCKET_NAME, Key=filepath, **kwargs)
+
+    except session().exceptions.NoSuchKey:
+        return None
+
+
+def head_file(filepath, **kwargs):
+    """As open_file, but with a HEAD request: the response has the details of
+    the object without its body."""
+    try:
+        return session().head_object(Bucket=AWS_BUCKET_NAME, Key=filepath, **kwargs)
 
     except ClientError as e:
-        logger.error("Error opening %s: %s", filepath, e)
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise e
+
+
+# ---------------------------------------------------------------------
+# Shared reads
+# Concurrent requests for the same object (e.g. the newest file, just
+# after it is published) share a single GET: requests for the object that
+# arrive while the first is still opening it, or before any of its body
+# has been dropped, read the same chunks - provided the GET started no
+# more than SHARED_READ_JOIN_AGE seconds ago, and the object read has the
+# ETag the caller expects, if it knows it. Chunks are read from S3 as the
+# furthest ahead reader asks for them, and dropped once every reader has
+# read them - or once SHARED_READ_WINDOW chunks behind the furthest, a
+# reader left further behind reading the rest with a GET of its own - so
+# a slow or stalled reader holds no more than the window in memory. The
+# GET is closed once its last reader leaves.
+# ---------------------------------------------------------------------
+SHARED_READ_WINDOW = 16  # chunks kept for readers behind the furthest ahead
+SHARED_READ_JOIN_AGE = 2  # seconds after which a read is not joined
+
+_shared_reads = {}
+_shared_reads_lock = threading.Lock()
+
+
+class SharedRead:
+    """One GET of an object, with its body shared by any number of readers."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.condition = threading.Condition()
+        self.opened = False
+        self.response = None
+        self.error = None
+        self.chunks = []
+        self.base = 0  # number of chunks of the body dropped before self.chunks
+        self.positions = {}  # reader -> number of the next chunk it reads
+        self.fetching = False
+        self.done = False
+        self.started = time.monotonic()
+
+    def join(self, reader):
+        """Add `reader`, returning False if it is too late to read from the
+        start of the body."""
+        with self.condition:
+            if (
+                self.base > 0
+                or self.done
+                or time.monotonic() - self.started > SHARED_READ_JOIN_AGE
+            ):
+                return False
+            self.positions[reader] = 0
+            return True
+
+    def leave(self, reader):
+        with self.condition:
+            self.positions.pop(reader, None)
+            self.drop()
+            abandoned = not self.positions and not self.done
+            if abandoned:
+                # no reader is left to finish reading the body
+                self.done = True
+                self.condition.notify_all()
+
+        if abandoned:
+            self.forget()
+            if self.response is not None:
+                self.response["Body"].close()
+
+    def open(self):
+        try:
+            response = open_file(self.filepath)
+        except Exception as e:  # pylint: disable=W0703
+            self.finish(e)
+            raise e
+
+        with self.condition:
+            self.response = response
+            self.opened = True
+            self.condition.notify_all()
+
+        if response is None:
+            self.finish()
+
+    def finish(self, error=None):
+        self.forget()
+
+        with self.condition:
+            self.error = error
+            self.opened = True
+            self.done = True
+            self.condition.notify_all()
+
+    def forget(self):
+        # later requests make a fresh GET
+        with _shared_reads_lock:
+            if _shared_reads.get(self.filepath) is self:
+                del _shared_reads[self.filepath]
+
+    def wait_opened(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.opened)
+            if self.response is None and self.error is not None:
+                raise self.error
+
+    def drop(self):
+        # drop the chunks every reader has read, and any beyond the window
+        end = self.base + len(self.chunks)
+        keep_from = max(
+            min(self.positions.values(), default=end), end - SHARED_READ_WINDOW
+        )
+        if keep_from > self.base:
+            del self.chunks[: keep_from - self.base]
+            self.base = keep_from
+
+    def get_chunk(self, reader, i):
+        """Return chunk i of the body for `reader`, reading it if no reader
+        has yet, None once the whole body has been returned, or False if
+        the chunk has been dropped."""
+        with self.condition:
+            while True:
+                if i < self.base:
+                    self.positions.pop(reader, None)
+                    return False
+                if i < self.base + len(self.chunks):
+                    self.positions[reader] = i + 1
+                    chunk = self.chunks[i - self.base]
+                    self.drop()
+                    return chunk
+                if self.done:
+                    self.positions.pop(reader, None)
+                    if self.error is not None:
+                        raise self.error
+                    return None
+                if not self.fetching:
+                    break
+                self.condition.wait()
+
+            self.fetching = True
+
+        try:
+            chunk = self.response["Body"].read(STREAM_CHUNK_SIZE)
+        except Exception as e:  # pylint: disable=W0703
+            logger.error("Error reading %s: %s", self.filepath, e)
+            with self.condition:
+                self.fetching = False
+            self.finish(e)
+            raise e
+
+        if not chunk:
+            with self.condition:
+                self.fetching = False
+            self.finish()
+            return self.get_chunk(reader, i)
+
+        with self.condition:
+            self.fetching = False
+            self.chunks.append(chunk)
+            self.positions[reader] = i + 1
+            self.drop()
+            joinable = self.base == 0
+            self.condition.notify_all()
+
+        if not joinable:
+            self.forget()
+        return chunk
+
+    def open_rest(self, offset):
+        """Open the body from byte `offset` with a GET of its own."""
+        logger.debug("Reading rest of %s from %s", self.filepath, offset)
+        return open_file(
+            self.filepath,
+            Range="bytes={offset}-".format(offset=offset),
+            IfMatch=self.response["ETag"],
+        )["Body"]
+
+
+class SharedBody:
+    """Readable file over the body of a SharedRead."""
+
+    def __init__(self, shared_read):
+        self.shared_read = shared_read
+        self.body = None  # the rest of the body, once fallen behind
+        self.chunk = b""
+        self.i = 0
+        self.offset = 0
+
+    def read(self, size=-1):
+        while not self.chunk:
+            if self.body is not None:
+                chunk = self.body.read(STREAM_CHUNK_SIZE)
+            else:
+                chunk = self.shared_read.get_chunk(self, self.i)
+                if chunk is False:
+                    self.body = self.shared_read.open_rest(self.offset)
+                    continue
+                self.i = self.i + 1
+
+            if not chunk:
+                return b""
+            self.chunk = chunk
+
+        if size < 0:
+            size = len(self.chunk)
+        data, self.chunk = self.chunk[:size], self.chunk[size:]
+        self.offset = self.offset + len(data)
+        return data
+
+    def close(self):
+        self.chunk = b""
+        self.shared_read.leave(self)
+        if self.body is not None:
+            self.body.close()
+
+
+def open_file_shared(filepath, etag=None):
+    """As open_file, but callers for the same filepath while one GET of it is
+    in flight share that GET - unless `etag` is given and the object read has
+    another. The body of the response returned is a SharedBody, to be closed
+    once read or abandoned."""
+    with _shared_reads_lock:
+        shared_read = _shared_reads.get(filepath)
+        first = shared_read is None
+        if not first:
+            body = SharedBody(shared_read)
+            first = not shared_read.join(body)
+        if first:
+            shared_read = _shared_reads[filepath] = SharedRead(filepath)
+            body = SharedBody(shared_read)
+            shared_read.join(body)
+
+    if first:
+        shared_read.open()
+    else:
+        logger.debug("Sharing read of %s", filepath)
+        shared_read.wait_opened()
+        if etag is not None and (shared_read.response or {}).get("ETag") != etag:
+            logger.debug("Shared read of %s is not of ETag %s", filepath, etag)
+            body.close()
+            return open_file(filepath)
+
+    if shared_read.response is None:
         return None
 
+    return dict(shared_read.response, Body=body)
+
+
+def get_presigned_url(filepath, expires_in, **kwargs):
+    """Return a URL that allows anyone holding it to GET filepath directly
+    from S3 for `expires_in` seconds. kwargs are added to the get_object
+    parameters, e.g. ResponseContentType="text/xml"."""
+    return session().generate_presigned_url(
+        "get_object",
+        Params={"Bucket": AWS_BUCKET_NAME, "Key": filepath, **kwargs},
+        ExpiresIn=expires_in,
+    )
+
 
 def read_file(filepath):
     generator = stream_file(filepath)
@@ -107,37 +393,113 @@ def stream_file(filepath):
         raise e
 
     else:
-        while True:
-            chunk = obj["Body"].read(STREAM_CHUNK_SIZE)
-            if chunk:
-                yield chunk
-            else:
-                break
+        yield from stream_body(obj["Body"])
+
+
+def stream_body(body):
+    while True:
+        chunk = body.read(STREAM_CHUNK_SIZE)
+        if chunk:
+            yield chunk
+        else:
+            break
 
 
-def write_file(filepath, jsoncontent):
-    session().put_object(Body=jsoncontent, Bucket=AWS_BUCKET_NAME, Key=filepath)
+def read_file_if_changed(filepath, etag):
+    """Read filepath unless its ETag still matches `etag`.
 
+    Returns a (content, etag, metadata) tuple, where content and metadata are
+    None if the object is unchanged since `etag` was taken.
+    """
+    kwargs = {}
+    if etag is not None:
+        kwargs["IfNoneMatch"] = etag
+
+    try:
+        obj = session().get_object(Bucket=AWS_BUCKET_NAME, Key=filepath, **kwargs)
+
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("304", "NotModified"):
+            return None, etag, None
+        raise e
+
+    return obj["Body"].read(), obj["ETag"], obj["Metadata"]
+
+
+class PreconditionFailed(Exception):
+    """A conditional write found the object it was to replace had changed."""
+
+
+def write_file(filepath, jsoncontent, metadata=None, **kwargs):
+    """Write filepath, returning its ETag. kwargs are passed to put_object,
+    e.g. IfMatch=etag to only replace the object if it is unchanged since
+    `etag` was taken, or IfNoneMatch="*" to only write a new object -
+    PreconditionFailed is raised if it cannot be."""
+    try:
+        response = session().put_object(
+            Body=jsoncontent,
+            Bucket=AWS_BUCKET_NAME,
+            Key=filepath,
+            Metadata=metadata or {},
+            **kwargs,
+        )
+
+    except ClientError as e:
+        if e.response["Error"]["Code"] in (
+            "412",
+            "PreconditionFailed",
+            "409",
+            "ConditionalRequestConflict",
+        ):
+            raise PreconditionFailed(filepath) from e
+        raise e
 
-def create_multipart_upload(filename):
-    resp = session().create_multipart_upload(Bucket=AWS_BUCKET_NAME, Key=filename)
+    return response["ETag"]
+
+
+def delete_files(filepaths):
+    # delete_objects takes at most 1000 keys at a time
+    for i in range(0, len(filepaths), 1000):
+        session().delete_objects(
+            Bucket=AWS_BUCKET_NAME,
+            Delete={
+                "Objects": [{"Key": key} for key in filepaths[i : i + 1000]],
+                "Quiet": True,
+            },
+        )
+
+
+def create_multipart_upload(filename, metadata=None):
+    resp = session().create_multipart_upload(
+        Bucket=AWS_BUCKET_NAME, Key=filename, Metadata=metadata or {}
+    )
     logger.debug("%s", resp)
     return resp["UploadId"]
 
 
 def upload_part(filename, uploadid, partnumber, bodypart):
-    session().upload_part(
+    resp = session().upload_part(
         Bucket=AWS_BUCKET_NAME,
         Key=filename,
         UploadId=uploadid,
         PartNumber=partnumber,
         Body=bodypart,
     )
+    return resp["ETag"]
 
 
-def complete_multipart_upload(filename, uploadid):
+def complete_multipart_upload(filename, uploadid, parts):
+    """`parts` lists the ETag of each uploaded part, in part number order."""
     session().complete_multipart_upload(
-        Bucket=AWS_BUCKET_NAME, Key=filename, UploadId=uploadid
+        Bucket=AWS_BUCKET_NAME,
+        Key=filename,
+        UploadId=uploadid,
+        MultipartUpload={
+            "Parts": [
+                {"ETag": etag, "PartNumber": partnumber}
+                for partnumber, etag in enumerate(parts, 1)
+            ]
+        },
     )
 
 
@@ -147,20 +509,96 @@ def abort_multipart_upload(filename, uploadid):
     )
 
 
-def get_file_list(prefix):
+class StreamingUpload:
+    """Stores a file that is written to it a piece at a time: with a single
+    PUT if it all fits in one part, or as a multipart upload otherwise.
+    Nothing is stored at `filename` until commit(), and abort() discards
+    whatever has been uploaded so far."""
+
+    def __init__(self, filename, metadata=None):
+        self.filename = filename
+        self.metadata = metadata or {}
+        self.buffer = bytearray()
+        self.uploadid = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= UPLOAD_PART_SIZE:
+            self.upload_part()
+
+    def upload_part(self):
+        if self.uploadid is None:
+            self.uploadid = create_multipart_upload(self.filename, self.metadata)
+
+        logger.debug("Uploading part %s of %s", len(self.parts) + 1, self.filename)
+        self.parts.append(
+            upload_part(
+                self.filename, self.uploadid, len(self.parts) + 1, bytes(self.buffer)
+            )
+        )
+        self.buffer.clear()
+
+    def commit(self, metadata=None):
+        """Store the file, with `metadata` in place of that given at the start
+        (which a multipart upload has to set before the content is known)."""
+        metadata = self.metadata if metadata is None else metadata
+
+        if self.uploadid is None:
+            session().put_object(
+                Body=bytes(self.buffer),
+                Bucket=AWS_BUCKET_NAME,
+                Key=self.filename,
+                Metadata=metadata,
+            )
+            return
+
+        if self.buffer:
+            self.upload_part()
+        complete_multipart_upload(self.filename, self.uploadid, self.parts)
+
+        if metadata != self.metadata:
+            session().copy_object(
+                Bucket=AWS_BUCKET_NAME,
+                CopySource={"Bucket": AWS_BUCKET_NAME, "Key": self.filename},
+                Key=self.filename,
+                Metadata=metadata,
+                MetadataDirective="REPLACE",
+            )
+
+    def abort(self):
+        if self.uploadid is not None:
+            logger.debug("Aborting upload of %s", self.filename)
+            abort_multipart_upload(self.filename, self.uploadid)
+            self.uploadid = None
+        self.buffer.clear()
+
+
+def get_file_list(prefix=None, start_after=""):
+    """Yield the objects (Key, Size, ETag, LastModified, ...) with keys
+    starting with prefix, the taric files folder by default, in key order
+    from the first key after `start_after`. Objects are listed a page (of up
+    to 1000) at a time, as they are needed."""
     if prefix is None:
         prefix = TARIC_FILES_FOLDER
-    files = session().list_objects(Bucket=AWS_BUCKET_NAME, Prefix=prefix)
-    try:
-        return files["Contents"]
-    except KeyError:
-        return []
+
+    paginator = session().get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=AWS_BUCKET_NAME, Prefix=prefix, StartAfter=start_after
+    ):
+        yield from page.get("Contents", [])
+
+
+def get_file_keys(prefix, start_after=""):
+    """Return the keys starting with prefix that sort after `start_after`, in
+    order."""
+    return [obj["Key"] for obj in get_file_list(prefix, start_after)]
 
 
 def sha512(filepath):
     hash_sha512 = hashlib.sha512()
     for chunk in stream_file(filepath):
-        hash_sha512.update(chunk)
+        offload(hash_sha512.update, chunk)
 
     return hash_sha512.hexdigest()
 
@@ -170,6 +608,10 @@ def get_taric_filepath(seq):
     return TARIC_FILES_FOLDER + "/" + seq + ".xml"
 
 
+def get_compressed_taric_filepath(seq):
+    return get_taric_filepath(seq) + ".gz"
+
+
 def get_temp_taric_filepath(seq):
     return TARIC_FILES_FOLDER + "/TEMP_" + seq + ".xml"
 
@@ -178,17 +620,89 @@ def get_taric_index_file():
     return TARIC_FILES_INDEX
 
 
-def stream_taric_file(seq):
-    if not file_exists(get_taric_filepath(seq)):
-        return None
+def get_taric_index_journal_folder():
+    return os.path.splitext(TARIC_FILES_INDEX)[0] + "-journal/"
 
-    return stream_file(get_taric_filepath(seq))
 
+def get_taric_index_shard_folder():
+    return os.path.splitext(TARIC_FILES_INDEX)[0] + "-shards/"
 
-def save_temp_taric_file(file, seq):
-    filename = get_temp_taric_filepath(seq)
-    write_file(filename, file)
-    return filename
+
+def open_taric_file(seq, byte_range=None, if_range=None, etag=None, head=False):
+    """Open the taric file for seq, or just `byte_range` of it (a Range header
+    value). If `if_range` (an ETag or a datetime) no longer matches the file
+    the whole file is opened instead, as for an HTTP If-Range request.
+    An unsatisfiable range raises ClientError with code InvalidRange (or 416,
+    for `head`). `etag` is the S3 ETag the file is expected to have, if known.
+    With `head`, only the details of the file are returned, without a body."""
+    filepath = get_taric_filepath(seq)
+    open_ = head_file if head else open_file
+    if byte_range is None:
+        return head_file(filepath) if head else open_file_shared(filepath, etag)
+
+    conditions = {}
+    if isinstance(if_range, str):
+        conditions["IfMatch"] = if_range
+    elif if_range is not None:
+        conditions["IfUnmodifiedSince"] = if_range
+
+    try:
+        return open_(filepath, Range=byte_range, **conditions)
+
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("412", "PreconditionFailed"):
+            raise e
+
+        logger.debug("%s changed since range validator was taken", filepath)
+        return open_(filepath)
+
+
+def open_compressed_taric_file(seq, head=False):
+    filepath = get_compressed_taric_filepath(seq)
+    return head_file(filepath) if head else open_file_shared(filepath)
+
+
+def get_compressed_taric_file_checksum(seq):
+    """Return the checksum of the file the compressed copy for seq was made
+    from, or None if there is no compressed copy."""
+    try:
+        response = session().head_object(
+            Bucket=AWS_BUCKET_NAME, Key=get_compressed_taric_filepath(seq)
+        )
+        return response["Metadata"].get("sha512")
+
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise e
+
+
+def save_compressed_taric_file(seq, file, checksum):
+    """Store a gzip compressed copy of the taric file for seq, read from
+    `file`. The copy records the checksum of the uncompressed file so that a
+    copy left behind by an overwrite is not mistaken for the current one."""
+    logger.debug("Compressing file %s", seq)
+
+    with tempfile.SpooledTemporaryFile(max_size=STREAM_CHUNK_SIZE * 8) as compressed:
+        with gzip.GzipFile(
+            fileobj=compressed, mode="wb", compresslevel=6, mtime=0
+        ) as gz:
+            for chunk in stream_body(file):
+                gz.write(chunk)
+        compressed.seek(0)
+
+        put_compressed_taric_file(seq, compressed, checksum)
+
+
+def put_compressed_taric_file(seq, compressed, checksum):
+    """Store `compressed`, an already gzip compressed copy of the taric file
+    for seq, as for save_compressed_taric_file."""
+    session().upload_fileobj(
+        compressed,
+        AWS_BUCKET_NAME,
+        get_compressed_taric_filepath(seq),
+        ExtraArgs={"Metadata": {"sha512": checksum}},
+    )
 
 
 def remove_temp_taric_file(seq):
@@ -204,6 +718,9 @@ def remove_taric_file(seq):
     filename = get_taric_filepath(seq)
     logger.debug("Removing file %s", filename)
     session().delete_object(Bucket=AWS_BUCKET_NAME, Key=filename)
+    session().delete_object(
+        Bucket=AWS_BUCKET_NAME, Key=get_compressed_taric_filepath(seq)
+    )
 
 
 def rename_file(fromname, toname):
@@ -220,25 +737,38 @@ def rename_file(fromname, toname):
     session().delete_object(Bucket=AWS_BUCKET_NAME, Key=fromname)
 
 
-def rename_taric_file(seq, filetime):
-    # AWS S3 has no rename - have to copy & delete
-    logger.debug("Renaming temp file to %s", get_taric_filepath(seq))
+# Asynchronous upload job functions
+def get_job_filepath(job_id):
+    return TARIC_JOBS_FOLDER + "/" + job_id + ".json"
+
+
+def get_job_upload_filepath(job_id):
+    return TARIC_JOBS_FOLDER + "/" + job_id + ".xml"
 
-    if filetime is not None:
-        logger.debug("Setting Metadata modified to %s", filetime)
-        session().copy_object(
-            Bucket=AWS_BUCKET_NAME,
-            CopySource={"Bucket": AWS_BUCKET_NAME, "Key": get_temp_taric_filepath(seq)},
-            Key=get_taric_filepath(seq),
-            Metadata={"modified": filetime},
-            MetadataDirective="REPLACE",
-        )
-    else:
-        session().copy_object(
-            Bucket=AWS_BUCKET_NAME,
-            CopySource={"Bucket": AWS_BUCKET_NAME, "Key": get_temp_taric_filepath(seq)},
-            Key=get_taric_filepath(seq),
-            MetadataDirective="REPLACE",
-        )
 
-    session().delete_object(Bucket=AWS_BUCKET_NAME, Key=get_temp_taric_filepath(seq))
+def get_job_list():
+    """Yield the objects (Key, LastModified, ...) of every job and job upload."""
+    yield from get_file_list(TARIC_JOBS_FOLDER + "/")
+
+
+def save_job_upload(file, job_id, modtime=None):
+    metadata = {} if modtime is None else {"modified": modtime}
+    session().upload_fileobj(
+        file,
+        AWS_BUCKET_NAME,
+        get_job_upload_filepath(job_id),
+        ExtraArgs={"Metadata": metadata},
+    )
+
+
+def open_job_upload(job_id):
+    """Open the file uploaded for a job, returning the get_object response,
+    with the modtime it was uploaded with as Metadata "modified", or None if
+    there is none."""
+    return open_file(get_job_upload_filepath(job_id))
+
+
+def remove_job_upload(job_id):
+    filename = get_job_upload_filepath(job_id)
+    logger.debug("Removing file %s", filename)
+    session().delete_object(Bucket=AWS_BUCKET_NAME, Key=filename)
@@ -20,8 +20,59 @@ API_ROOT = os.environ.get("API_ROOT", "http://localhost:8080/api/v1/")
 APIKEYS = strtolist(os.environ.get("APIKEYS"))
 APIKEYS_UPLOAD = strtolist(os.environ.get("APIKEYS_UPLOAD"))
 
+# Redirect file downloads to short-lived presigned S3 URLs, for every client
+# or only for the clients with these (SHA256 hashed) API keys.
+DOWNLOAD_REDIRECT = as_bool(os.environ.get("DOWNLOAD_REDIRECT", "false"))
+APIKEYS_DOWNLOAD_REDIRECT = strtolist(os.environ.get("APIKEYS_DOWNLOAD_REDIRECT"))
+PRESIGNED_URL_EXPIRY = int(os.environ.get("PRESIGNED_URL_EXPIRY", 300))
+
 TARIC_FILES_FOLDER = os.environ.get("TARIC_FILES_FOLDER", "taricfiles")
 TARIC_FILES_INDEX = os.environ.get("TARIC_FILES_INDEX", "taricdeltas.json")
+TARIC_JOBS_FOLDER = os.environ.get("TARIC_JOBS_FOLDER", "jobs")
+
+# Seconds the in-process copy of the index is trusted before it is revalidated
+# against S3 with a conditional GET.
+INDEX_CACHE_TTL = float(os.environ.get("INDEX_CACHE_TTL", 10))
+
+# Seconds between compactions of the index journal into the index snapshot,
+# and the age at which a change in the journal may be compacted.
+INDEX_COMPACT_INTERVAL = float(os.environ.get("INDEX_COMPACT_INTERVAL", 300))
+INDEX_JOURNAL_SETTLE = float(os.environ.get("INDEX_JOURNAL_SETTLE", 60))
+
+# Most month shards of the index kept parsed in memory (each is read from S3
+# when a request first needs it, and never changes once written).
+INDEX_SHARD_CACHE = int(os.environ.get("INDEX_SHARD_CACHE", 36))
+
+# Seconds that index changes are held for others to be written with them.
+INDEX_WRITE_WINDOW = float(os.environ.get("INDEX_WRITE_WINDOW", 0.05))
+
+# Cache-Control max-age (seconds) for delta files and for delta file listings.
+TARIC_FILE_MAX_AGE = int(os.environ.get("TARIC_FILE_MAX_AGE", 31536000))
+TARIC_DELTAS_MAX_AGE = int(os.environ.get("TARIC_DELTAS_MAX_AGE", 60))
+
+# Most files that may be downloaded in one bulk (zip) download.
+BULK_DOWNLOAD_MAX_FILES = int(os.environ.get("BULK_DOWNLOAD_MAX_FILES", 1000))
+
+# Number of files read and hashed at once when (re)building the index.
+REBUILD_CONCURRENCY = int(os.environ.get("REBUILD_CONCURRENCY", 8))
+
+# Native threads that XSD validation and checksumming are run on, so that they
+# do not hold up other requests (0 runs them in the requesting greenlet).
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 4))
+
+# Most files that may be uploaded in one batch upload, and the number of them
+# validated and stored at once.
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get("BATCH_UPLOAD_MAX_FILES", 1000))
+BATCH_UPLOAD_CONCURRENCY = int(os.environ.get("BATCH_UPLOAD_CONCURRENCY", 8))
+
+# Asynchronous uploads (?async=true) processed at once by each instance.
+UPLOAD_JOB_WORKERS = int(os.environ.get("UPLOAD_JOB_WORKERS", 2))
+
+# Seconds an unfinished job may go without being updated before it is deemed
+# abandoned (by an instance that stopped) and taken over, and seconds a
+# finished job is kept.
+JOB_STALE_AFTER = float(os.environ.get("JOB_STALE_AFTER", 600))
+JOB_EXPIRY = float(os.environ.get("JOB_EXPIRY", 60 * 60 * 24 * 7))
 
 TARICAPI_LOG_LEVEL = os.environ.get("TARICAPI_LOG_LEVEL", "INFO")
 
@@ -46,6 +97,12 @@ LOGGING = {
 }
 
 STREAM_CHUNK_SIZE = 1024 * 512  # ~0.5mb
+UPLOAD_PART_SIZE = 1024 * 1024 * 8  # 8mb, S3 multipart uploads need parts >= 5mb
+
+# Local directory to cache recently downloaded files in (disabled if unset),
+# and the most bytes it may hold.
+FILE_CACHE_DIR = os.environ.get("FILE_CACHE_DIR", None)
+FILE_CACHE_SIZE = int(os.environ.get("FILE_CACHE_SIZE", 1024 * 1024 * 1024))
 
 # This only needs to be set under testing conditions to use MinIO - in local and deployed envs, we use AWS S3.
 S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", None)
@@ -0,0 +1,11 @@
+import os
+
+from gevent import monkey
+
+# patched before anything else is imported, as taricapi patches it when run
+monkey.patch_all()
+
+# config requires these at import; the tests replace the S3 client itself
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_BUCKET_NAME", "test-bucket")
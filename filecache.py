@@ -0,0 +1,136 @@
+import collections
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from config import FILE_CACHE_DIR, FILE_CACHE_SIZE
+
+logger = logging.getLogger("taricapi.filecache")
+
+
+# -------------------------------------------------------------------------
+# Read-through cache of taric files on local disk
+# Files are cached under their sequence number and checksum, so a file that
+# is overwritten is cached afresh rather than served stale. The cache is
+# bounded to FILE_CACHE_SIZE bytes, evicting the least recently used files.
+# Disabled unless FILE_CACHE_DIR is set.
+# -------------------------------------------------------------------------
+PARTIAL_PREFIX = ".partial-"  # files still being written
+PARTIAL_EXPIRY = 60 * 60  # seconds before a partial file is deemed abandoned
+
+_lock = threading.Lock()
+_files = None  # file name -> size, least recently used first
+_size = 0
+
+
+def is_enabled():
+    return FILE_CACHE_DIR is not None
+
+
+def get_cache_name(seq, checksum, content_encoding=None):
+    name = seq + "-" + checksum + ".xml"
+    if content_encoding == "gzip":
+        name = name + ".gz"
+    return name
+
+
+def _load():
+    # build the LRU order from the files already on disk, oldest first
+    global _files, _size  # pylint: disable=W0603
+
+    if _files is not None:
+        return
+
+    os.makedirs(FILE_CACHE_DIR, exist_ok=True)
+    found = []
+    for entry in os.scandir(FILE_CACHE_DIR):
+        if entry.name.startswith(PARTIAL_PREFIX):
+            if time.time() - entry.stat().st_mtime > PARTIAL_EXPIRY:
+                _remove(entry.name)
+        elif entry.is_file():
+            found.append((entry.stat().st_mtime, entry.name, entry.stat().st_size))
+
+    _files = collections.OrderedDict((name, size) for _, name, size in sorted(found))
+    _size = sum(_files.values())
+    logger.info("%s files, %s bytes, found in file cache", len(_files), _size)
+
+
+def _remove(name):
+    try:
+        os.remove(os.path.join(FILE_CACHE_DIR, name))
+    except FileNotFoundError:
+        pass
+
+
+def open_cached_file(name):
+    """Return an open binary file and its size for `name`, or None if it is
+    not cached."""
+    global _size  # pylint: disable=W0603
+
+    with _lock:
+        _load()
+        if name not in _files:
+            return None
+
+        path = os.path.join(FILE_CACHE_DIR, name)
+        try:
+            f = open(path, "rb")  # pylint: disable=R1732
+        except FileNotFoundError:
+            # removed from under us, e.g. by another process sharing the cache
+            _size = _size - _files.pop(name)
+            return None
+
+        _files.move_to_end(name)
+        os.utime(path)  # keep the LRU order across restarts
+
+        return f, _files[name]
+
+
+def _add(name, temp_path):
+    global _size  # pylint: disable=W0603
+
+    with _lock:
+        _load()
+        if name in _files:
+            # cached by a concurrent request while this one was reading
+            os.remove(temp_path)
+            return
+
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, os.path.join(FILE_CACHE_DIR, name))
+        _files[name] = size
+        _size = _size + size
+
+        while _size > FILE_CACHE_SIZE and len(_files) > 1:
+            evicted, evicted_size = _files.popitem(last=False)
+            logger.debug("Evicting %s from file cache", evicted)
+            _remove(evicted)
+            _size = _size - evicted_size
+
+
+def read_through(name, chunks, size):
+    """Yield `chunks`, keeping a copy of them in the cache as `name` once all
+    `size` bytes have been read. Nothing is cached if the reader stops early.
+    The copy is cached before the last chunk is yielded, as a WSGI server may
+    stop reading once it has sent Content-Length bytes."""
+    with _lock:
+        _load()
+
+    fd, temp_path = tempfile.mkstemp(dir=FILE_CACHE_DIR, prefix=PARTIAL_PREFIX)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            written = 0
+            for chunk in chunks:
+                f.write(chunk)
+                written = written + len(chunk)
+                if written == size:
+                    f.close()
+                    _add(name, temp_path)
+                    logger.debug("Cached %s", name)
+                yield chunk
+
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,33 @@
+import logging
+
+from gevent.threadpool import ThreadPool
+
+from config import WORKER_THREADS
+
+logger = logging.getLogger("taricapi.offload")
+
+
+# ---------------------------------------------------------------------------
+# Pool of native threads for CPU bound work
+# XSD validation and checksumming run in C without yielding, so in the
+# greenlet handling a request they stall every other request, downloads
+# and /healthcheck included, until they finish. Run on the pool instead, the
+# greenlet waits for them cooperatively while lxml, hashlib and zlib work
+# with the GIL released.
+# ---------------------------------------------------------------------------
+_pool = None
+
+
+def offload(func, *args):
+    """Return func(*args), called on the worker thread pool, or directly if
+    WORKER_THREADS is 0."""
+    global _pool  # pylint: disable=W0603
+
+    if WORKER_THREADS == 0:
+        return func(*args)
+
+    if _pool is None:
+        logger.debug("Starting %s worker threads", WORKER_THREADS)
+        _pool = ThreadPool(WORKER_THREADS)
+
+    return _pool.apply(func, args)
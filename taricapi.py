@@ -6,7 +6,6 @@ import click
 import datetime
 import gevent
 import hashlib
-import io
 import json
 import re
 import requests
@@ -14,40 +13,80 @@ import sentry_sdk
 import signal
 import sys
 import threading
+import time
 import uuid
+import zipfile
 
 from botocore.exceptions import ClientError
 from elasticapm.contrib.flask import ElasticAPM
 from flask import Flask, render_template, make_response, request, Response
 from flask.logging import create_logger
+from gevent.pool import Pool
 from gevent.pywsgi import WSGIServer
 from logging.config import dictConfig
 from sentry_sdk.integrations.flask import FlaskIntegration
-from lxml import etree
+from werkzeug.http import quote_etag
+from werkzeug.http import unquote_etag
+from werkzeug.wsgi import wrap_file
 
-from apifiles3 import write_file
 from apifiles3 import remove_taric_file
+from apifiles3 import PreconditionFailed
+from apifiles3 import open_job_upload
+from apifiles3 import remove_job_upload
 from apifiles3 import remove_temp_taric_file
-from apifiles3 import rename_taric_file
-from apifiles3 import save_temp_taric_file
-from apifiles3 import stream_taric_file
+from apifiles3 import save_job_upload
+from apifiles3 import get_presigned_url
+from apifiles3 import get_compressed_taric_file_checksum
+from apifiles3 import open_compressed_taric_file
+from apifiles3 import open_file
+from apifiles3 import open_taric_file
+from apifiles3 import save_compressed_taric_file
+from apifiles3 import stream_body
 from apifiles3 import get_taric_index_file
 from apifiles3 import get_taric_filepath
 from apifiles3 import get_file_list
-from apifiles3 import get_file_size
-from apifiles3 import read_file
+from apifiles3 import get_file_info
 from apifiles3 import file_exists
 from apifiles3 import sha512
-from apifiles3 import modification_date
+from filecache import get_cache_name
+from filecache import open_cached_file
+from filecache import read_through
+from filecache import is_enabled as is_file_cache_enabled
+from taricindex import compaction_paused
+from taricindex import get_index
+from taricindex import public_entry
+from taricindex import get_journal_key
+from taricindex import journal_index
+from taricindex import run_compactor
+from taricindex import save_index
+from taricjobs import get_job
+from taricjobs import is_valid_job_id
+from taricjobs import new_job
+from taricjobs import run_job_recovery
+from taricjobs import submit_job
+from taricupload import GzipReader
+from taricupload import InvalidContentEncoding
+from taricupload import InvalidTaricFile
+from taricupload import store_taric_file
 from config import (
     API_ROOT,
     APIKEYS,
+    APIKEYS_DOWNLOAD_REDIRECT,
     APIKEYS_UPLOAD,
+    BATCH_UPLOAD_CONCURRENCY,
+    BATCH_UPLOAD_MAX_FILES,
+    BULK_DOWNLOAD_MAX_FILES,
+    DOWNLOAD_REDIRECT,
     PORT,
+    PRESIGNED_URL_EXPIRY,
     LOGGING,
+    REBUILD_CONCURRENCY,
     NUM_PROXIES,
     REQUIRE_AUTH_FOR_READS,
     SENTRY_DSN,
+    STREAM_CHUNK_SIZE,
+    TARIC_DELTAS_MAX_AGE,
+    TARIC_FILE_MAX_AGE,
     SENTRY_ENABLE_TRACING,
     SENTRY_ENVIRONMENT,
     SENTRY_TRACES_SAMPLE_RATE,
@@ -56,7 +95,9 @@ from config import (
     ENVIRONMENT,
     GA_TRACKING_ID,
     GA_ENDPOINT,
+    INDEX_JOURNAL_SETTLE,
 )
+from utils import as_bool
 
 # Use apifile for file system, apifiles3 for AWS S3
 
@@ -106,6 +147,19 @@ def in_apikeys_upload(apikey):
     return hashed_apikey in APIKEYS_UPLOAD
 
 
+def in_apikeys_download_redirect(apikey):
+    hashed_apikey = hashlib.sha256(apikey.encode("ascii")).hexdigest()
+    return hashed_apikey in APIKEYS_DOWNLOAD_REDIRECT
+
+
+def is_download_redirect(request):
+    if DOWNLOAD_REDIRECT:
+        return True
+
+    apikey = get_apikey(request)
+    return in_apikeys_download_redirect(apikey)
+
+
 def is_auth(request):
     if not REQUIRE_AUTH_FOR_READS:
         return True
@@ -120,6 +174,27 @@ def is_auth_upload(request):
     return in_apikeys_upload(apikey)
 
 
+def get_cache_control(max_age, immutable=False):
+    # responses to authenticated requests must not be served to other clients
+    visibility = "private" if REQUIRE_AUTH_FOR_READS else "public"
+    cache_control = "{visibility}, max-age={max_age}".format(
+        visibility=visibility, max_age=max_age
+    )
+
+    if immutable:
+        cache_control = cache_control + ", immutable"
+
+    return cache_control
+
+
+def get_taric_file_etag(checksum, content_encoding=None):
+    # each encoding of a file is a different representation, with its own ETag
+    if content_encoding is not None:
+        checksum = checksum + "-" + content_encoding
+
+    return quote_etag(checksum)
+
+
 # ---------------------------
 # URL Parameter validation
 # Dates as ISO8601 YYYY-MM-DD
@@ -142,42 +217,39 @@ def is_virus_checked(file):
     return True
 
 
-def is_schema_validated(xmlfile):
-    logger.debug("VALIDATING %s", xmlfile)
-
-    xsd_doc = etree.parse("taric3.xsd")
-    xsd = etree.XMLSchema(xsd_doc)
-
-    try:
-        xml = etree.parse(io.BytesIO(read_file(xmlfile)))
-
-    except Exception:  # pylint: disable=W0703
-        logger.info("Unable to parse file as XML")
-        return False
-
-    if not xsd.validate(xml):
-        logger.info("XML Failed validation")
-        logger.debug("%s", xsd.error_log)
-    else:
-        logger.info("XML validates against taric3 schema")
-
-    return xsd.validate(xml)
-
-
 # ------------------
 # Create index entry
+# "stored" records the S3 object the entry was built from, so a rebuild
+# can reuse the entry for as long as the object is unchanged
 # ------------------
 def create_index_entry(seq):
+    info = get_file_info(get_taric_filepath(seq))
+    if info["sha512"] is None:
+        # files uploaded before checksums were recorded as metadata
+        logger.debug("No checksum recorded for %s, reading file", seq)
+        info["sha512"] = sha512(get_taric_filepath(seq))
+
     index_entry = {
         "id": int(seq),
-        "issue_date": modification_date(get_taric_filepath(seq)),
+        "issue_date": info["modified"],
         "url": API_ROOT + "taricfiles/" + seq,
-        "sha512": sha512(get_taric_filepath(seq)),
-        "size": get_file_size(get_taric_filepath(seq)),
+        "sha512": info["sha512"],
+        "size": info["size"],
+        "stored": {"etag": info["etag"], "last_modified": info["last_modified"]},
     }
     return index_entry
 
 
+def is_index_entry_current(index_entry, file):
+    """Is `index_entry` still a true description of the listed S3 object `file`?"""
+    stored = index_entry.get("stored", {})
+    return (
+        stored.get("etag") == file["ETag"]
+        and stored.get("last_modified") == file["LastModified"].isoformat()[:19]
+        and index_entry["size"] == file["Size"]
+    )
+
+
 # ----------------
 # Google Analytics
 # ----------------
@@ -208,36 +280,200 @@ def _send_to_google_analytics(
 # --------------------------------
 # Rebuild master file index (JSON)
 # --------------------------------
-def rebuild_index(nocheck):
-    if not file_exists(get_taric_index_file()) or nocheck:
+REBUILD_PROGRESS_INTERVAL = 100  # files between progress log messages
+REBUILD_ATTEMPTS = 3  # tries to save a rebuild, should the index be replaced
+
+# progress of the rebuild running in this instance, if any, and the outcome
+# of the last to finish - see GET /api/v1/rebuildindex
+rebuild_progress = {
+    "state": "idle",
+    "full": None,
+    "started": None,
+    "files_to_index": None,
+    "files_indexed": None,
+    "files_per_second": None,
+    "eta_seconds": None,
+    "last_completed": None,
+    "last_result": None,
+}
+
+
+def rebuild_index(nocheck, full=False):
+    index_exists = file_exists(get_taric_index_file())
+    if not index_exists or nocheck:
         logger.info("*** Rebuilding file index... ***")
-        all_deltas = []
-
-        files = get_file_list(None)
-        logger.info("%s", files)
-        for file in files:
-            # build entry for file just uploaded
-            # TODO (possibly) Add Metadata generation -> then could have api /taricfilemd/...
-            # TODO - combine with individual update_index..
-            f = file["Key"]
-            f = f[f.rindex("/") + 1 :]  # remove folder prefix
-            logger.info("Found file %s", f)
-
-            if f.startswith("TEMP_"):
-                logger.info("Removing temporary file %s", f)
-                seq = f[5:-4]  # remove TEMP_ file prefix and .xml extension
-                remove_temp_taric_file(seq)
-            else:
-                if is_valid_seq(f[:-4]):  # ignore non taric files
-                    seq = f[:-4]  # remove .xml extension
-                    all_deltas.append(create_index_entry(seq))
+        rebuild_progress.update(
+            full=full,
+            started=datetime.datetime.now().isoformat()[:19],
+            files_to_index=None,
+            files_indexed=None,
+            files_per_second=None,
+            eta_seconds=None,
+        )
 
-        logger.debug("%s delta files listed after update", str(len(all_deltas)))
+        # Entries for files that are unchanged since they were indexed are
+        # reused, so only new or changed files are fetched and hashed
+        existing = {}
+        if index_exists and not full:
+            existing = {d["id"]: d for d in get_index(revalidate=True).all_entries()}
+
+        # The rebuilt index replaces only the index file read when it started,
+        # so compaction is held off here meanwhile. Should another instance
+        # replace it, the rebuild is repeated against the new index file -
+        # reusing the entries just made, so only files changed since are read
+        with compaction_paused():
+            for attempt in range(1, REBUILD_ATTEMPTS + 1):
+                etag = None
+                if file_exists(get_taric_index_file()):
+                    etag = get_file_info(get_taric_index_file())["etag"]
+
+                # Files listed below include those of every change already
+                # journalled, but changes not yet settled may still be being
+                # written, so are left to be applied on top of the rebuilt index
+                watermark = get_journal_key(
+                    datetime.datetime.now(datetime.timezone.utc)
+                    - datetime.timedelta(seconds=INDEX_JOURNAL_SETTLE)
+                )
+
+                all_deltas = index_files(existing)
+
+                # persist updated index
+                rebuild_progress.update(state="saving", eta_seconds=0)
+                try:
+                    save_index(all_deltas, watermark, etag)
+                    break
+                except PreconditionFailed:
+                    logger.info(
+                        "Index replaced by another instance during rebuild %s of %s",
+                        attempt,
+                        REBUILD_ATTEMPTS,
+                    )
+                    existing = {d["id"]: d for d in all_deltas}
+            else:
+                logger.error("Index replaced by another instance during rebuild")
+                rebuild_progress.update(
+                    state="idle",
+                    last_completed=datetime.datetime.now().isoformat()[:19],
+                    last_result="index replaced by another instance",
+                )
+                return
 
-        # persist updated index
-        all_deltass = json.dumps(all_deltas)
-        write_file(get_taric_index_file(), all_deltass)
         logger.info("Index rebuild complete")
+        rebuild_progress.update(
+            state="idle",
+            last_completed=datetime.datetime.now().isoformat()[:19],
+            last_result="complete",
+        )
+
+
+def index_files(existing):
+    """Return index entries for the taric files stored, reusing those in
+    `existing` for files unchanged since, in sequence order."""
+    rebuild_progress.update(state="listing")
+    all_deltas = []
+    to_index = []
+
+    for file in get_file_list():
+        # build entry for file just uploaded
+        # TODO (possibly) Add Metadata generation -> then could have api /taricfilemd/...
+        f = file["Key"]
+        f = f[f.rindex("/") + 1 :]  # remove folder prefix
+        logger.info("Found file %s", f)
+
+        if f.startswith("TEMP_"):
+            logger.info("Removing temporary file %s", f)
+            seq = f[5:-4]  # remove TEMP_ file prefix and .xml extension
+            remove_temp_taric_file(seq)
+        else:
+            if is_valid_seq(f[:-4]):  # ignore non taric files
+                seq = f[:-4]  # remove .xml extension
+                index_entry = existing.get(int(seq))
+                if index_entry is not None and is_index_entry_current(
+                    index_entry, file
+                ):
+                    index_entry = dict(index_entry, url=API_ROOT + "taricfiles/" + seq)
+                else:
+                    index_entry = None  # filled in below
+                    to_index.append((len(all_deltas), seq))
+                all_deltas.append(index_entry)
+
+    # Each new or changed file costs several S3 round trips and a full
+    # read to hash it, so these are indexed REBUILD_CONCURRENCY at a time.
+    # imap yields in the order given, keeping the index in sequence order
+    logger.info("%s new or changed delta files to index", str(len(to_index)))
+    rebuild_progress.update(
+        state="indexing", files_to_index=len(to_index), files_indexed=0
+    )
+    started = time.monotonic()
+    pool = Pool(REBUILD_CONCURRENCY)
+    indexed = pool.imap(create_index_entry, [seq for _, seq in to_index])
+    for count, ((i, seq), index_entry) in enumerate(zip(to_index, indexed), 1):
+        all_deltas[i] = index_entry
+        elapsed = time.monotonic() - started
+        rate = count / elapsed if elapsed else 0.0
+        rebuild_progress.update(
+            files_indexed=count,
+            files_per_second=round(rate, 1),
+            eta_seconds=round((len(to_index) - count) / rate) if rate else None,
+        )
+        if count % REBUILD_PROGRESS_INTERVAL == 0 or count == len(to_index):
+            logger.info(
+                "Indexed %s of %s delta files, %.1f files/s",
+                str(count),
+                str(len(to_index)),
+                rate,
+            )
+
+    logger.debug("%s delta files listed after update", str(len(all_deltas)))
+    return all_deltas
+
+
+# ---------------------------------------------------------------------
+# Rebuild scheduler
+# At most one rebuild runs at a time in this instance. Rebuilds asked
+# for while one runs are folded into a single rebuild run after it (a
+# full one, if any of them asked for a full rebuild)
+# ---------------------------------------------------------------------
+rebuild_lock = threading.Lock()
+rebuild_running = False
+rebuild_pending = None  # None, or whether the rebuild to follow is full
+
+
+def schedule_rebuild(full=False):
+    """Start a rebuild, or have one follow the rebuild running. Returns True
+    if the rebuild is started now."""
+    global rebuild_running, rebuild_pending  # pylint: disable=W0603
+
+    with rebuild_lock:
+        if rebuild_running:
+            rebuild_pending = full or bool(rebuild_pending)
+            return False
+        rebuild_running = True
+
+    logger.debug("Starting thread to rebuild index.")
+    threading.Thread(target=run_rebuilds, args=[full]).start()
+    return True
+
+
+def run_rebuilds(full):
+    global rebuild_running, rebuild_pending  # pylint: disable=W0603
+
+    while True:
+        try:
+            rebuild_index(True, full)
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("Error rebuilding index: %s", str(exc))
+            rebuild_progress.update(
+                state="idle",
+                last_completed=datetime.datetime.now().isoformat()[:19],
+                last_result="failed",
+            )
+
+        with rebuild_lock:
+            if rebuild_pending is None:
+                rebuild_running = False
+                return
+            full, rebuild_pending = rebuild_pending, None
 
 
 @app.route("/api/v1/rebuildindex", methods=["POST"])
@@ -246,44 +482,42 @@ def rebuild_index_controller():
         logger.info("API key not provided or not authorised")
         return Response("403 Unauthorised", status=403)
 
-    logger.debug("Starting thread to rebuild index.")
-    threading.Thread(target=rebuild_index, args=[True]).start()
+    # ?full=true re-reads every file rather than only new or changed ones
+    full = as_bool(request.args.get("full"))
+
+    if not schedule_rebuild(full):
+        logger.debug("Rebuild queued to follow that running")
+        return Response("202 index will be rebuilt after current rebuild", status=202)
 
     return Response("202 index is being rebuilt", status=202)
 
 
+@app.route("/api/v1/rebuildindex", methods=["GET"])
+def rebuild_index_status():
+    if not is_auth_upload(request):
+        logger.info("API key not provided or not authorised")
+        return Response("403 Unauthorised", status=403)
+
+    status = dict(rebuild_progress, pending=rebuild_pending is not None)
+    r = make_response(json.dumps(status))
+    r.headers.set("Content-Type", "application/json")
+    r.headers.set("Cache-Control", "no-cache")
+    return r
+
+
 # -------------------------------
 # Update master file index (JSON)
+# Changes are written to the index journal, leaving the rest of the
+# index untouched - see taricindex
 # -------------------------------
 
 
-def update_index(seq):
-    all_deltas = json.loads(read_file(get_taric_index_file()))
-    logger.debug(
-        "%s delta files listed in %s", str(len(all_deltas)), get_taric_index_file()
-    )
-
-    # build entry for file just uploaded
+def update_index(*seqs):
+    # build entries for files just uploaded
     # TODO (possibly) Add Metadata file generation -> then could have api /taricfilesmd/...
-
-    # if the file was overwritten, just update the index, else append
-    existing = [d for d in all_deltas if d["id"] == int(seq)]
-    if len(existing) > 0:
-        logger.info("File %s overwritten", seq)
-        i = 0
-        for d in all_deltas:
-            logger.debug("%s", d)
-            if d["id"] == int(seq):
-                all_deltas[i] = create_index_entry(seq)
-            i = i + 1
-    else:
-        all_deltas.append(create_index_entry(seq))
-
-    logger.debug("%s delta files listed after update", str(len(all_deltas)))
-
-    # persist updated index
-    all_deltass = json.dumps(all_deltas)
-    write_file(get_taric_index_file(), all_deltass)
+    index_entries = Pool(REBUILD_CONCURRENCY).map(create_index_entry, seqs)
+    journal_index(upsert=index_entries)
+    logger.debug("%s delta files added to index", str(len(index_entries)))
 
 
 # ---------------------------------------------
@@ -328,56 +562,138 @@ def hello():
 # API to retrieve list of delta files (for a date or defaults to yesterday to get latest file)
 # NB using today would provide files loaded today
 # but no guarantee that the list may change (i.e. extend) later due to further files
+# Also ?from=YYYY-MM-DD[&to=YYYY-MM-DD] for a range of dates (to defaults to yesterday)
+# or ?after_seq=NNNNNN for every file following a sequence number
 # --------------------------------------------------------------------------------------------
 
 
+def get_yesterday():
+    yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+    return yesterday.strftime("%Y-%m-%d")
+
+
 @app.route("/api/v1/taricdeltas/<date>", methods=["GET"])
 @app.route("/api/v1/taricdeltas/", defaults={"date": ""}, methods=["GET"])
 @app.route("/api/v1/taricdeltas", defaults={"date": ""}, methods=["GET"])
 def taricdeltas(date):
-    # Default to yesterday
-    if date == "" or date is None:
-        yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
-        date = yesterday.strftime("%Y-%m-%d")
-        logger.debug("defaulted date to %s", date)
+    from_date = request.args.get("from")
+    to_date = request.args.get("to")
+    after_seq = request.args.get("after_seq")
+    is_range = from_date is not None or to_date is not None or after_seq is not None
+
+    if is_range and date != "":
+        logger.debug("date given with a range query")
+        return Response("Bad request [date and range both given] (400)", status=400)
+
+    if after_seq is not None and (from_date is not None or to_date is not None):
+        logger.debug("after_seq given with a date range")
+        return Response(
+            "Bad request [after_seq and date range both given] (400)", status=400
+        )
+
+    if after_seq is not None:
+        if not is_valid_seq(after_seq):
+            logger.debug("after_seq is invalid")
+            return Response("Bad request [invalid after_seq] (400)", status=400)
+
+    elif is_range:
+        if from_date is None:
+            logger.debug("to date given without from date")
+            return Response("Bad request [from date required] (400)", status=400)
 
-    if not is_valid_date(date):
-        logger.debug("date is invalid")
-        return Response("Bad request [invalid date] (400)", status=400)
+        if to_date is None:
+            to_date = get_yesterday()
+            logger.debug("defaulted to date to %s", to_date)
+
+        if not is_valid_date(from_date) or not is_valid_date(to_date):
+            logger.debug("date range is invalid")
+            return Response("Bad request [invalid date] (400)", status=400)
+
+        if from_date > to_date:
+            logger.debug("from date is after to date")
+            return Response("Bad request [from date after to date] (400)", status=400)
+
+    else:
+        # Default to yesterday
+        if date == "" or date is None:
+            date = get_yesterday()
+            logger.debug("defaulted date to %s", date)
+
+        if not is_valid_date(date):
+            logger.debug("date is invalid")
+            return Response("Bad request [invalid date] (400)", status=400)
+
+        from_date = to_date = date
 
     if not is_auth(request):
         logger.debug("API key not provided or not authorised")
         return Response("403 Unauthorised", status=403)
 
-    logger.debug("date is %s", date)
-
     # All Taric files uploaded are stored in the index
-    # Find files that have the issue date the same as the requested date
-    # Output the response filtered by the date
-    all_deltas = json.loads(read_file(get_taric_index_file()))
+    # Find files that were issued in the requested date range (or after the
+    # requested sequence number) and output them in sequence order
+    deltas = get_index()
     logger.debug(
-        "%s delta files listed in %s", str(len(all_deltas)), get_taric_index_file()
+        "%s index shards listed in %s", str(len(deltas.months)), get_taric_index_file()
     )
 
-    deltas_on_date = [d for d in all_deltas if d["issue_date"].startswith(date)]
+    if after_seq is not None:
+        logger.debug("after_seq is %s", after_seq)
+        deltas_in_range = deltas.after_seq(after_seq)
+    else:
+        logger.debug("dates are %s to %s", from_date, to_date)
+        deltas_in_range = deltas.issued_between(from_date, to_date)
 
-    if len(deltas_on_date) == 0:
-        logger.debug("No delta files available for date %s", date)
+    if len(deltas_in_range) == 0:
+        logger.debug("No delta files available for request")
         return Response("404 Not found", status=404)
 
-    logger.debug("%s delta files for date %s", str(len(deltas_on_date)), date)
+    logger.debug("%s delta files for request", str(len(deltas_in_range)))
 
-    deltas_json = json.dumps(deltas_on_date)
+    deltas_json = json.dumps([public_entry(d) for d in deltas_in_range])
 
     r = make_response(deltas_json)
 
     r.headers.set("Content-Type", "application/json")
-    return r
+    r.headers.set("Cache-Control", get_cache_control(TARIC_DELTAS_MAX_AGE))
+    r.set_etag(hashlib.sha256(deltas_json.encode("utf-8")).hexdigest())
+    return r.make_conditional(request)
 
 
 # -----------------------------------------
 # API to retrieve contents of specific file
 # -----------------------------------------
+def get_cached_taric_file_response(seq, checksum, content_encoding=None):
+    """Return a response serving the locally cached copy of a taric file, or
+    None if it is not cached. Ranges of uncompressed files are served too."""
+    if not is_file_cache_enabled():
+        return None
+
+    cached = open_cached_file(get_cache_name(seq, checksum, content_encoding))
+    if cached is None:
+        return None
+
+    logger.debug("Serving %s from file cache", seq)
+    f, size = cached
+    r = Response(
+        wrap_file(request.environ, f, STREAM_CHUNK_SIZE),
+        mimetype="text/xml",
+        direct_passthrough=True,
+        headers={
+            "Content-Length": size,
+            "ETag": get_taric_file_etag(checksum, content_encoding),
+            "Cache-Control": get_cache_control(TARIC_FILE_MAX_AGE, immutable=True),
+            "Vary": "Accept-Encoding",
+        },
+    )
+
+    if content_encoding is not None:
+        r.headers["Content-Encoding"] = content_encoding
+        return r
+
+    return r.make_conditional(request, accept_ranges=True, complete_length=size)
+
+
 @app.route("/api/v1/taricfiles/<seq>", methods=["GET"])
 @app.route("/api/v1/taricfiles", defaults={"seq": ""}, methods=["GET"])
 def taricfiles(seq):
@@ -389,15 +705,275 @@ def taricfiles(seq):
         logger.debug("seq is invalid")
         return Response("400 Bad request [invalid seq]", status=400)
 
-    body_generator = stream_taric_file(seq)
-    if body_generator is None:
+    # Files are tagged with their checksum, so a client or cache that already
+    # holds the current file is answered from the index without going to S3.
+    # Once published, files change so rarely that they are cached as immutable
+    index_entry = get_index().get(seq)
+    if index_entry is not None:
+        for content_encoding in (None, "gzip"):
+            etag = get_taric_file_etag(index_entry["sha512"], content_encoding)
+            if request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+                logger.debug("Requested file not modified %s", seq)
+                return Response(
+                    status=304,
+                    headers={
+                        "ETag": etag,
+                        "Cache-Control": get_cache_control(
+                            TARIC_FILE_MAX_AGE, immutable=True
+                        ),
+                        "Vary": "Accept-Encoding",
+                    },
+                )
+
+    # Optionally send the client to S3 for the file itself, so the bytes do
+    # not pass through this process. Files that are not indexed carry on
+    # below, to be served or reported as not found
+    if index_entry is not None and is_download_redirect(request):
+        logger.debug("Redirecting to presigned URL for %s", seq)
+        url = get_presigned_url(
+            get_taric_filepath(seq),
+            PRESIGNED_URL_EXPIRY,
+            ResponseContentType="text/xml",
+            ResponseCacheControl=get_cache_control(TARIC_FILE_MAX_AGE, immutable=True),
+        )
+        return Response(
+            status=307, headers={"Location": url, "Cache-Control": "no-store"}
+        )
+
+    # Single byte ranges are passed through to S3 so interrupted downloads can
+    # resume, otherwise (including multiple ranges) the whole file is sent
+    byte_range = None
+    if_range = None
+    if request.range is not None and len(request.range.ranges) == 1:
+        byte_range = request.range.to_header()
+        if request.if_range.etag is None:
+            if_range = request.if_range.date
+        elif index_entry is None or request.if_range.etag != index_entry["sha512"]:
+            # not the current checksum, but it may be an S3 ETag
+            if_range = quote_etag(request.if_range.etag)
+        logger.debug("Requested range %s if %s", byte_range, if_range)
+
+    # HEAD requests are answered from the details of the file, without
+    # opening its body
+    head = request.method == "HEAD"
+
+    # Serve the gzip compressed copy of the file to clients that accept it,
+    # provided it was made from the current file. Ranges are only served
+    # from the uncompressed file.
+    # Copies of files already read from S3 are served from the local file
+    # cache, if enabled, when they match the current file
+    taric_file = None
+    content_encoding = None
+    if (
+        byte_range is None
+        and index_entry is not None
+        and request.accept_encodings["gzip"]
+    ):
+        r = get_cached_taric_file_response(seq, index_entry["sha512"], "gzip")
+        if r is not None:
+            return r
+
+        taric_file = open_compressed_taric_file(seq, head)
+        if taric_file is not None:
+            if taric_file["Metadata"].get("sha512") == index_entry["sha512"]:
+                content_encoding = "gzip"
+            else:
+                logger.debug("Compressed file is out of date %s", seq)
+                if not head:
+                    taric_file["Body"].close()
+                taric_file = None
+
+    if taric_file is None and index_entry is not None:
+        r = get_cached_taric_file_response(seq, index_entry["sha512"])
+        if r is not None:
+            return r
+
+    # A single GET both opens the file and gives the details for the headers
+    try:
+        if taric_file is None:
+            taric_file = open_taric_file(
+                seq,
+                byte_range,
+                if_range,
+                index_entry.get("stored", {}).get("etag") if index_entry else None,
+                head,
+            )
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("InvalidRange", "416"):
+            raise e
+
+        logger.debug("Requested range not satisfiable %s", byte_range)
+        headers = {"Accept-Ranges": "bytes"}
+        if "ActualObjectSize" in e.response["Error"]:
+            size = e.response["Error"]["ActualObjectSize"]
+            headers["Content-Range"] = "bytes */" + size
+        return Response("416 Range not satisfiable", status=416, headers=headers)
+
+    if taric_file is None:
         logger.debug("Requested file not found %s", seq)
         return Response("404 Taric file does not exist", status=404)
 
-    return Response(
-        body_generator,
+    # checksum recorded at upload, or by the index for older files
+    checksum = taric_file["Metadata"].get("sha512")
+    if checksum is None and index_entry is not None:
+        checksum = index_entry["sha512"]
+
+    body = [] if head else stream_body(taric_file["Body"])
+    if (
+        not head
+        and is_file_cache_enabled()
+        and "ContentRange" not in taric_file
+        and index_entry is not None
+        and checksum == index_entry["sha512"]
+    ):
+        body = read_through(
+            get_cache_name(seq, checksum, content_encoding),
+            body,
+            taric_file["ContentLength"],
+        )
+
+    r = Response(
+        body,
         mimetype="text/xml",
-        headers={"Content-Length": get_file_size(get_taric_filepath(seq))},
+        headers={
+            "Content-Length": taric_file["ContentLength"],
+            "ETag": (
+                get_taric_file_etag(checksum, content_encoding)
+                if checksum
+                else taric_file["ETag"]
+            ),
+            "Accept-Ranges": "bytes",
+            "Cache-Control": get_cache_control(TARIC_FILE_MAX_AGE, immutable=True),
+            "Vary": "Accept-Encoding",
+        },
+    )
+    r.last_modified = taric_file["LastModified"]
+    if not head:
+        # let go of the S3 response (and any read shared with other requests)
+        # however the response ends, even if the client stops reading
+        r.call_on_close(taric_file["Body"].close)
+
+    if content_encoding is not None:
+        r.headers["Content-Encoding"] = content_encoding
+
+    if "ContentRange" in taric_file:
+        r.status_code = 206
+        r.headers["Content-Range"] = taric_file["ContentRange"]
+
+    return r
+
+
+# ---------------------------------------------------------------
+# API to retrieve several files as one zip archive
+# ?from=NNNNNN[&to=NNNNNN] for a range of sequence numbers
+# or ?date=YYYY-MM-DD for the files issued on a date.
+# The archive is built as it is sent, a file at a time, starting
+# with a manifest of the files' index entries.
+# ---------------------------------------------------------------
+class ZipStream:
+    """Write-only file collecting what zipfile writes, to be sent on.
+    Having no tell() or seek(), zipfile writes it as a stream."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def stream_zip(deltas):
+    out = ZipStream()
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(
+            "manifest.json", json.dumps([public_entry(d) for d in deltas], indent=2)
+        )
+        yield from out.take()
+
+        for index_entry in deltas:
+            seq = "{id:06d}".format(id=index_entry["id"])
+            issue_date = datetime.datetime.fromisoformat(index_entry["issue_date"][:19])
+            info = zipfile.ZipInfo(seq + ".xml", issue_date.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.file_size = index_entry["size"]  # so zipfile knows if zip64 is needed
+
+            # a GET of its own rather than a shared read, holding a chunk at a time
+            taric_file = open_file(get_taric_filepath(seq))
+            if taric_file is None:
+                # removed since the index was read - end the download as failed
+                raise IOError("Taric file {seq} does not exist".format(seq=seq))
+
+            with archive.open(info, "w") as member:
+                for chunk in stream_body(taric_file["Body"]):
+                    member.write(chunk)
+                    yield from out.take()
+            yield from out.take()
+
+    yield from out.take()
+
+
+@app.route("/api/v1/taricfiles/bulk", methods=["GET"])
+def taricfiles_bulk():
+    from_seq = request.args.get("from")
+    to_seq = request.args.get("to")
+    date = request.args.get("date")
+
+    if date is not None:
+        if from_seq is not None or to_seq is not None:
+            logger.debug("date given with a sequence range")
+            return Response("400 Bad request [date and range both given]", status=400)
+
+        if not is_valid_date(date):
+            logger.debug("date is invalid")
+            return Response("400 Bad request [invalid date]", status=400)
+
+    else:
+        if from_seq is None or not is_valid_seq(from_seq):
+            logger.debug("from seq is invalid")
+            return Response("400 Bad request [invalid from seq]", status=400)
+
+        if to_seq is not None and not is_valid_seq(to_seq):
+            logger.debug("to seq is invalid")
+            return Response("400 Bad request [invalid to seq]", status=400)
+
+    if not is_auth(request):
+        logger.debug("API key not provided or not authorised")
+        return Response("403 Unauthorised", status=403)
+
+    deltas = get_index()
+    if date is not None:
+        deltas_in_range = deltas.issued_on(date)
+        filename = "taricfiles-" + date + ".zip"
+    else:
+        to_seq = to_seq or "999999"
+        deltas_in_range = deltas.seq_between(from_seq, to_seq)
+        filename = "taricfiles-" + from_seq + "-" + to_seq + ".zip"
+
+    if len(deltas_in_range) == 0:
+        logger.debug("No delta files available for request")
+        return Response("404 Not found", status=404)
+
+    if len(deltas_in_range) > BULK_DOWNLOAD_MAX_FILES:
+        logger.debug("%s delta files requested", str(len(deltas_in_range)))
+        return Response(
+            "400 Bad request [more than {max} files requested]".format(
+                max=BULK_DOWNLOAD_MAX_FILES
+            ),
+            status=400,
+        )
+
+    logger.debug("Sending %s delta files as %s", str(len(deltas_in_range)), filename)
+    return Response(
+        stream_zip(deltas_in_range),
+        mimetype="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="' + filename + '"'},
     )
 
 
@@ -418,14 +994,12 @@ def taricfiles_delete(seq):
     logger.info("attempt to remove taric file %s", seq)
     try:
         remove_taric_file(seq)
+        journal_index(delete=[seq])
     except ClientError as e:
         logger.error(repr(e))
         return Response("400 Error - client error", status=200)
 
-    logger.debug("Starting thread to rebuild index.")
-    threading.Thread(target=rebuild_index, args=[True]).start()
-
-    return Response("200 OK File deleted, reindexing", status=200)
+    return Response("200 OK File deleted", status=200)
 
 
 # --------------------------------------------------------------------
@@ -475,24 +1049,90 @@ def taricfiles_upload(seq):
             modtime = request.args.get("modtime")
             logger.debug("file mod time is %s", modtime)
 
-    # Save the uploaded XML file as temporary
-    temp_file_name = save_temp_taric_file(file, seq)
+    return receive_taric_file(file.stream, seq, modtime)
+
 
+# --------------------------------------------------------------------
+# API to upload a file as the request body (PUT), which may be gzip
+# compressed (Content-Encoding: gzip) - the file is read from the
+# request as it arrives, with no form to parse and buffer
+# --------------------------------------------------------------------
+@app.route("/api/v1/taricfiles/<seq>", methods=["PUT"])
+def taricfiles_put(seq):
+    if not is_auth_upload(request):
+        logger.debug("API key not provided or not authorised")
+        return Response("403 Unauthorised", status=403)
+
+    if not is_valid_seq(seq):
+        logger.debug("seq is invalid")
+        return Response("400 Bad request [invalid seq]", status=400)
+
+    modtime = request.args.get("modtime")
+    if modtime is not None and not is_valid_datetime(modtime):
+        logger.debug("Invalid file modification timestamp specified %s", modtime)
+        return Response("400 Invalid file modification timestamp specified", status=400)
+
+    content_encoding = request.headers.get("Content-Encoding", "identity").lower()
+    if content_encoding == "gzip":
+        file = GzipReader(request.stream)
+    elif content_encoding == "identity":
+        file = request.stream
+    else:
+        logger.debug("Unsupported content encoding %s", content_encoding)
+        return Response("415 Unsupported content encoding", status=415)
+
+    return receive_taric_file(file, seq, modtime)
+
+
+def receive_taric_file(file, seq, modtime):
+    """Store the file uploaded for seq, returning the response to the upload."""
     # TODO - should virus check ..
-    if not is_virus_checked(file.read()):
+    if not is_virus_checked(file):
         logger.debug("File failed virus check")
-        remove_temp_taric_file(seq)
         return Response("400 Failed virus check", status=400)
 
-    # Validate XML against XSD
-    if not is_schema_validated(temp_file_name):
+    # ?async=true stores the file as received and answers at once, leaving it
+    # to be validated and indexed by a job - see /api/v1/jobs/<job_id>
+    if as_bool(request.args.get("async")):
+        job = new_job(seq)
+        try:
+            save_job_upload(file, job["id"], modtime)
+            submit_job(job, process_upload_job, job["id"], seq)
+        except InvalidContentEncoding as exc:
+            logger.debug("File could not be decoded: %s", str(exc))
+            return Response("400 Bad request [invalid content encoding]", status=400)
+        except (IOError, ClientError) as exc:
+            logger.error("Error saving file %s.xml: %s", seq, str(exc))
+            return Response("500 Error saving file", status=500)
+
+        logger.info("File %s queued as job %s", seq, job["id"])
+        r = make_response(json.dumps(job), 202)
+        r.headers.set("Content-Type", "application/json")
+        r.headers.set("Location", API_ROOT + "jobs/" + job["id"])
+        return r
+
+    # Validate the XML against the XSD while storing it, then update the
+    # index - used by the deltas API
+    try:
+        stored = store_taric_file(file, seq, modtime)
+    except InvalidTaricFile as exc:
         logger.debug("File failed schema check")
-        remove_temp_taric_file(seq)
-        return Response("400 Failed schema check", status=400)
+        return Response(
+            json.dumps({"message": "400 Failed schema check", "errors": exc.errors}),
+            status=400,
+            content_type="application/json",
+        )
+    except InvalidContentEncoding as exc:
+        logger.debug("File could not be decoded: %s", str(exc))
+        return Response("400 Bad request [invalid content encoding]", status=400)
+    except (IOError, ClientError) as exc:
+        logger.error("Error saving file %s.xml: %s", seq, str(exc))
+        return Response("500 Error saving file", status=500)
+
+    if not stored:
+        return Response("200 OK File unchanged", status=200)
 
-    # Rename the temporary XML file and update the index - used by the deltas API
     try:
-        rename_taric_file(seq, modtime)
         update_index(seq)
     except IOError as exc:
         logger.error("Error saving file %s.xml: %s", seq, str(exc))
@@ -501,6 +1141,149 @@ def taricfiles_upload(seq):
     return Response("200 OK File uploaded", status=200)
 
 
+# --------------------------------------------------------------------
+# API to upload several files at once: as form elements named by their
+# sequence numbers, or as a zip file (form element "archive") of files
+# named {sequenceid}.xml (optionally prefixed, e.g. DIT{sequenceid}.xml).
+# The files are validated and stored concurrently, then indexed together
+# --------------------------------------------------------------------
+def store_batch_file(seq, file, stored):
+    """Store one file of a batch upload, returning its result for the response
+    and adding seq to `stored` if it was stored."""
+    result = {"seq": seq}
+
+    if not is_virus_checked(file):
+        logger.debug("File %s failed virus check", seq)
+        result.update(status=400, message="400 Failed virus check")
+        return result
+
+    try:
+        if store_taric_file(file, seq):
+            stored.append(seq)
+            result.update(status=200, message="200 OK File uploaded")
+        else:
+            result.update(status=200, message="200 OK File unchanged")
+    except InvalidTaricFile as exc:
+        logger.debug("File %s failed schema check", seq)
+        result.update(status=400, message="400 Failed schema check", errors=exc.errors)
+    except (IOError, ClientError) as exc:
+        logger.error("Error saving file %s.xml: %s", seq, str(exc))
+        result.update(status=500, message="500 Error saving file")
+
+    return result
+
+
+@app.route("/api/v1/taricfiles/batch", methods=["POST"])
+def taricfiles_batch_upload():
+    if not is_auth_upload(request):
+        logger.debug("API key not provided or not authorised")
+        return Response("403 Unauthorised", status=403)
+
+    files = []
+    for name, file in request.files.items(multi=True):
+        if name != "archive":
+            if not is_valid_seq(name):
+                logger.debug("seq %s is invalid", name)
+                return Response("400 Bad request [invalid seq]", status=400)
+            files.append((name, file.stream))
+            continue
+
+        try:
+            archive = zipfile.ZipFile(file.stream)  # pylint: disable=R1732
+        except zipfile.BadZipFile:
+            logger.debug("archive is not a zip file")
+            return Response("400 Bad request [invalid archive]", status=400)
+
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            match = re.search(r"(\d{6})\.xml$", info.filename)
+            if match is None:
+                logger.debug("%s in archive is not a taric file", info.filename)
+                return Response("400 Bad request [invalid seq]", status=400)
+            files.append((match.group(1), archive.open(info)))
+
+    if len(files) == 0:
+        logger.debug("No file uploaded")
+        return Response("400 No file uploaded", status=400)
+
+    if len(files) > BATCH_UPLOAD_MAX_FILES:
+        logger.debug("%s files uploaded", str(len(files)))
+        return Response(
+            "400 Bad request [more than {max} files uploaded]".format(
+                max=BATCH_UPLOAD_MAX_FILES
+            ),
+            status=400,
+        )
+
+    if len({seq for seq, _ in files}) < len(files):
+        logger.debug("seq uploaded more than once")
+        return Response("400 Bad request [duplicate seq]", status=400)
+
+    logger.info("Storing %s files", len(files))
+    stored = []
+    results = Pool(BATCH_UPLOAD_CONCURRENCY).map(
+        lambda seq_file: store_batch_file(*seq_file, stored), files
+    )
+
+    # a single index update for every file stored
+    if stored:
+        try:
+            update_index(*stored)
+        except IOError as exc:
+            logger.error("Error updating index: %s", str(exc))
+            for result in results:
+                if result["seq"] in stored:
+                    result.update(status=500, message="500 Error saving file")
+
+    # each file has a status of its own, so a batch that partly failed is
+    # answered 207 Multi-Status rather than with the status of any one file
+    return Response(
+        json.dumps({"files": results}),
+        status=200 if all(result["status"] == 200 for result in results) else 207,
+        content_type="application/json",
+    )
+
+
+def process_upload_job(job_id, seq):
+    try:
+        upload = open_job_upload(job_id)
+        if upload is None:
+            raise IOError("Upload for job {job_id} is gone".format(job_id=job_id))
+
+        modtime = upload["Metadata"].get("modified")
+        if store_taric_file(upload["Body"], seq, modtime):
+            update_index(seq)
+    finally:
+        remove_job_upload(job_id)
+
+
+# ------------------------------------------------------------
+# API to check on an asynchronous upload (?async=true) - its
+# status is one of queued, processing, done or failed, failed
+# jobs giving the reason (and any schema errors) as a message
+# ------------------------------------------------------------
+@app.route("/api/v1/jobs/<job_id>", methods=["GET"])
+def jobs(job_id):
+    if not is_auth_upload(request):
+        logger.debug("API key not provided or not authorised")
+        return Response("403 Unauthorised", status=403)
+
+    if not is_valid_job_id(job_id):
+        logger.debug("job id is invalid")
+        return Response("400 Bad request [invalid job id]", status=400)
+
+    job = get_job(job_id)
+    if job is None:
+        logger.debug("Job %s not found", job_id)
+        return Response("404 Not found", status=404)
+
+    r = make_response(json.dumps(job))
+    r.headers.set("Content-Type", "application/json")
+    r.headers.set("Cache-Control", "no-cache")
+    return r
+
+
 def get_server():
     if SENTRY_DSN:
         sentry_sdk.init(
@@ -555,6 +1338,8 @@ def get_server():
 def serve():
     """Run webserver."""
     rebuild_index(False)
+    gevent.spawn(run_compactor)
+    gevent.spawn(run_job_recovery, process_upload_job)
     server = get_server()
 
     # TODO - is this supposed to hook SIGTERM twice? - if so document why.
@@ -566,9 +1351,13 @@ def serve():
 
 
 @click.command()
-def ls():
+@click.option("--after", help="List only files after this sequence number.")
+def ls(after):
     """List delta, temporary and other files."""
-    for f in get_file_list():
+    start_after = get_taric_filepath(after) if after else ""
+    for file in get_file_list(start_after=start_after):
+        f = file["Key"]
+        f = f[f.rindex("/") + 1 :]  # remove folder prefix
         # File identification logic taken from rebuild_index
         if f.startswith("TEMP_"):
             seq = f[5:-4]  # remove TEMP_ file prefix and .xml extension
@@ -582,9 +1371,32 @@ def ls():
 
 
 @click.command()
-def index():
+@click.option("--full", is_flag=True, help="Re-read every file, not just changes.")
+def index(full):
     """Rebuild file index."""
-    rebuild_index(False)
+    rebuild_index(full, full)
+
+
+@click.command()
+def compress():
+    """Make compressed copies of delta files that lack an up to date one."""
+    for index_entry in get_index().all_entries():
+        seq = "{id:06d}".format(id=index_entry["id"])
+        if get_compressed_taric_file_checksum(seq) == index_entry["sha512"]:
+            continue
+
+        taric_file = open_file(get_taric_filepath(seq))
+        if taric_file is None:
+            click.echo("Skipping {seq}, file not found".format(seq=seq))
+            continue
+        checksum = taric_file["Metadata"].get("sha512")
+        if checksum is not None and checksum != index_entry["sha512"]:
+            click.echo("Skipping {seq}, file changed since indexed".format(seq=seq))
+            taric_file["Body"].close()
+            continue
+
+        click.echo("Compressing {seq}".format(seq=seq))
+        save_compressed_taric_file(seq, taric_file["Body"], index_entry["sha512"])
 
 
 @click.command(help="Delta sequence number [6 digits].")
@@ -596,7 +1408,7 @@ def rmdelta(seq):
         return
 
     remove_taric_file(seq)
-    rebuild_index(False)
+    journal_index(delete=[seq])
 
 
 @click.group(no_args_is_help=False, invoke_without_command=True)
@@ -612,4 +1424,5 @@ if __name__ == "__main__":
     cli.add_command(ls)
     cli.add_command(serve)
     cli.add_command(index)
+    cli.add_command(compress)
     cli()
@@ -0,0 +1,598 @@
+import bisect
+import collections
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+import gevent
+from gevent.event import AsyncResult
+from gevent.queue import Queue
+
+from apifiles3 import PreconditionFailed
+from apifiles3 import delete_files
+from apifiles3 import get_file_keys
+from apifiles3 import get_taric_index_file
+from apifiles3 import get_taric_index_journal_folder
+from apifiles3 import get_taric_index_shard_folder
+from apifiles3 import read_file
+from apifiles3 import read_file_if_changed
+from apifiles3 import write_file
+from config import INDEX_CACHE_TTL
+from config import INDEX_COMPACT_INTERVAL
+from config import INDEX_JOURNAL_SETTLE
+from config import INDEX_SHARD_CACHE
+from config import INDEX_WRITE_WINDOW
+
+logger = logging.getLogger("taricapi.index")
+
+
+def public_entry(entry):
+    """Return `entry` without the S3 object details kept for rebuilds."""
+    return {k: v for k, v in entry.items() if k != "stored"}
+
+
+# ----------------------------------------------------------------
+# Index entries held sorted by id and by issue date so that single
+# entries, date ranges and sequence ranges are found by bisection
+# ----------------------------------------------------------------
+class DeltaIndex:
+    """Delta file index entries with sorted lookups by id and issue date."""
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda d: d["id"])
+        self._ids = [d["id"] for d in self.entries]
+
+        self._by_date = sorted(
+            self.entries, key=lambda d: (d["issue_date"][:10], d["id"])
+        )
+        self._dates = [d["issue_date"][:10] for d in self._by_date]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, seq):
+        """Return the entry for `seq`, or None if it is not indexed."""
+        i = bisect.bisect_left(self._ids, int(seq))
+        if i < len(self._ids) and self._ids[i] == int(seq):
+            return self.entries[i]
+        return None
+
+    def issued_between(self, from_date, to_date):
+        """Return entries issued from `from_date` to `to_date` (YYYY-MM-DD,
+        inclusive) in sequence order."""
+        lo = bisect.bisect_left(self._dates, from_date)
+        hi = bisect.bisect_right(self._dates, to_date)
+        return sorted(self._by_date[lo:hi], key=lambda d: d["id"])
+
+    def issued_on(self, date):
+        return self.issued_between(date, date)
+
+    def seq_between(self, from_seq, to_seq):
+        """Return entries with sequence numbers from `from_seq` to `to_seq`
+        inclusive."""
+        lo = bisect.bisect_left(self._ids, int(from_seq))
+        hi = bisect.bisect_right(self._ids, int(to_seq))
+        return self.entries[lo:hi]
+
+    def after_seq(self, seq):
+        """Return entries with a sequence number greater than `seq`."""
+        return self.entries[bisect.bisect_right(self._ids, int(seq)) :]
+
+
+# -------------------------------------------------------------------
+# The index is split into a shard per month of issue date, so that a
+# lookup reads only the months it touches and a change rewrites only
+# the months it changes. The index file (taricdeltas.json) is a small
+# manifest listing each month's shard, with the first and last sequence
+# numbers in it for lookups by sequence number.
+#
+# Shards are stored under a digest of their content, so a shard never
+# changes once written and is cached without being revalidated; the
+# INDEX_SHARD_CACHE most recently used are kept parsed in memory. A
+# shard no longer listed is kept RETIRED_SHARD_EXPIRY seconds, for
+# instances still reading an index file that lists it, then removed.
+# -------------------------------------------------------------------
+MAX_SEQ = 999999
+RETIRED_SHARD_EXPIRY = 60 * 60  # seconds a shard is kept once replaced
+
+_shard_lock = threading.Lock()
+_shards = collections.OrderedDict()  # shard key -> DeltaIndex, least recent first
+
+
+def get_month(entry):
+    return entry["issue_date"][:7]
+
+
+def group_by_month(entries):
+    months = collections.defaultdict(list)
+    for entry in entries:
+        months[get_month(entry)].append(entry)
+    return dict(months)
+
+
+def get_shard_info(key, entries):
+    """Return the manifest's listing of shard `key` holding `entries`, which
+    are in sequence order."""
+    return {
+        "key": key,
+        "first": entries[0]["id"],
+        "last": entries[-1]["id"],
+        "count": len(entries),
+    }
+
+
+def load_shard(key):
+    """Return the DeltaIndex of the shard stored at `key`."""
+    with _shard_lock:
+        if key in _shards:
+            _shards.move_to_end(key)
+            return _shards[key]
+
+    shard = DeltaIndex(json.loads(read_file(key)))
+    logger.debug("%s delta files loaded from %s", len(shard), key)
+
+    with _shard_lock:
+        _shards[key] = shard
+        while len(_shards) > INDEX_SHARD_CACHE:
+            _shards.popitem(last=False)
+
+    return shard
+
+
+def read_manifest(content):
+    """Return the manifest in index file `content`, and the shards of it held
+    in memory. An index file written before the index was sharded holds every
+    entry, which are held as shards in memory until it is next compacted."""
+    manifest = json.loads(content)
+    if not isinstance(manifest, list):
+        return manifest, {}
+
+    loaded = {
+        month: DeltaIndex(entries)
+        for month, entries in group_by_month(manifest).items()
+    }
+    shards = {month: get_shard_info(None, d.entries) for month, d in loaded.items()}
+    return {"shards": shards, "retired": {}}, loaded
+
+
+class ShardedIndex:
+    """The delta file index, with the same lookups as DeltaIndex, as month
+    shards read only when a lookup needs them plus the journal's changes
+    to them.
+
+    `shards` maps each month (YYYY-MM) to its listing in the manifest, and
+    `loaded` months to shards already held in memory."""
+
+    def __init__(self, shards, changes, loaded=None):
+        self.shards = shards
+        self.months = sorted(shards)
+        self.changes = changes
+        self.loaded = loaded or {}
+
+        # sequence number -> entry (None if deleted) for each file changed
+        self.overlay = {}
+        for change in changes:
+            for seq in change.get("delete", []):
+                self.overlay[seq] = None
+            for entry in change.get("upsert", []):
+                self.overlay[entry["id"]] = entry
+
+    def _shard(self, month):
+        if month in self.loaded:
+            return self.loaded[month]
+        return load_shard(self.shards[month]["key"])
+
+    def _months_holding(self, from_seq, to_seq):
+        return [
+            month
+            for month in self.months
+            if self.shards[month]["first"] <= to_seq
+            and self.shards[month]["last"] >= from_seq
+        ]
+
+    def _stored(self, seq):
+        # the entry for seq in the shards, before the journal's changes
+        for month in self._months_holding(seq, seq):
+            entry = self._shard(month).get(seq)
+            if entry is not None:
+                return entry
+        return None
+
+    def _merge(self, entries, wanted):
+        # `entries` from the shards with the journal's changes applied, adding
+        # those changed entries `wanted` by the lookup
+        merged = [d for d in entries if d["id"] not in self.overlay]
+        merged.extend(d for d in self.overlay.values() if d is not None and wanted(d))
+        return sorted(merged, key=lambda d: d["id"])
+
+    def get(self, seq):
+        """Return the entry for `seq`, or None if it is not indexed."""
+        if int(seq) in self.overlay:
+            return self.overlay[int(seq)]
+        return self._stored(int(seq))
+
+    def issued_between(self, from_date, to_date):
+        """Return entries issued from `from_date` to `to_date` (YYYY-MM-DD,
+        inclusive) in sequence order."""
+        entries = []
+        for month in self.months:
+            if from_date[:7] <= month <= to_date[:7]:
+                entries.extend(self._shard(month).issued_between(from_date, to_date))
+        return self._merge(
+            entries, lambda d: from_date <= d["issue_date"][:10] <= to_date
+        )
+
+    def issued_on(self, date):
+        return self.issued_between(date, date)
+
+    def seq_between(self, from_seq, to_seq):
+        """Return entries with sequence numbers from `from_seq` to `to_seq`
+        inclusive."""
+        from_seq, to_seq = int(from_seq), int(to_seq)
+        entries = []
+        for month in self._months_holding(from_seq, to_seq):
+            entries.extend(self._shard(month).seq_between(from_seq, to_seq))
+        return self._merge(entries, lambda d: from_seq <= d["id"] <= to_seq)
+
+    def after_seq(self, seq):
+        """Return entries with a sequence number greater than `seq`."""
+        return self.seq_between(int(seq) + 1, MAX_SEQ)
+
+    def all_entries(self):
+        """Return every entry in sequence order - reading every shard."""
+        return self.seq_between(0, MAX_SEQ)
+
+    def changed_months(self):
+        """Return the months whose shards the journal's changes change."""
+        months = set()
+        for seq, entry in self.overlay.items():
+            if entry is not None:
+                months.add(get_month(entry))
+            stored = self._stored(seq)
+            if stored is not None:
+                months.add(get_month(stored))
+        return months
+
+    def month_entries(self, month):
+        """Return the entries issued in `month`, in sequence order."""
+        entries = self._shard(month).entries if month in self.shards else []
+        return sorted(
+            (d for d in apply_changes(entries, self.changes) if get_month(d) == month),
+            key=lambda d: d["id"],
+        )
+
+
+# -------------------------------------------------------------------
+# The index file is a snapshot of the index, and a journal records the
+# changes made since, one object per change, so that an upload writes
+# only its own change however large the index grows, and concurrent
+# uploads cannot overwrite each other's changes.
+#
+# Journal keys start with the time they were written, so list in the
+# order the changes were made. The index file records in its metadata
+# the key up to which the journal has been folded into its shards (its
+# watermark); readers apply the changes after the watermark on top of
+# them. The compactor folds changes into the shards they change once
+# they are INDEX_JOURNAL_SETTLE seconds old - by when any change made
+# before them has been written - and removes them from the journal one
+# compaction later, once no reader can still be using the index file
+# they were not folded into.
+#
+# The index is trusted for INDEX_CACHE_TTL seconds, after which it is
+# revalidated against S3: a conditional GET on the index file's ETag,
+# so an unchanged index file costs a 304 rather than a download and
+# parse, and a listing of the journal from the watermark.
+# -------------------------------------------------------------------
+JOURNAL_TIME_FORMAT = "%Y%m%dT%H%M%S.%fZ"
+
+_lock = threading.Lock()
+_deltas = None
+_manifest = None
+_loaded = {}  # month -> shard, for an index file written before sharding
+_etag = None
+_watermark = ""
+_changes = {}  # journal key -> change, for changes after the watermark
+_checked = 0.0
+
+
+def get_journal_key(when):
+    """Return the journal key for changes made at `when` (a UTC datetime) -
+    without the unique suffix, it sorts before any change made at or after."""
+    return get_taric_index_journal_folder() + when.strftime(JOURNAL_TIME_FORMAT)
+
+
+def apply_changes(entries, changes):
+    """Return `entries` with `changes` (in the order given) applied."""
+    by_id = {d["id"]: d for d in entries}
+    for change in changes:
+        for seq in change.get("delete", []):
+            by_id.pop(seq, None)
+        for entry in change.get("upsert", []):
+            by_id[entry["id"]] = entry
+    return list(by_id.values())
+
+
+def _revalidate():
+    global _deltas, _manifest, _loaded, _etag, _watermark  # pylint: disable=W0603
+    global _changes  # pylint: disable=W0603
+
+    content, etag, metadata = read_file_if_changed(get_taric_index_file(), _etag)
+    changed = content is not None
+    if changed:
+        _manifest, _loaded = read_manifest(content)
+        _etag = etag
+        _watermark = metadata.get("journal", "")
+        _changes = {k: v for k, v in _changes.items() if k > _watermark}
+        logger.debug(
+            "%s index shards listed in %s",
+            len(_manifest["shards"]),
+            get_taric_index_file(),
+        )
+
+    keys = get_file_keys(get_taric_index_journal_folder(), _watermark)
+    for key in keys:
+        if key not in _changes:
+            _changes[key] = json.loads(read_file(key))
+            changed = True
+    logger.debug("%s changes in index journal", len(keys))
+
+    if changed or _deltas is None:
+        _deltas = ShardedIndex(
+            _manifest["shards"], [_changes[k] for k in sorted(_changes)], _loaded
+        )
+
+
+def get_index(revalidate=False):
+    """Return the ShardedIndex, refreshing the cached copy if it is older than
+    INDEX_CACHE_TTL (or `revalidate` is set).
+
+    The returned index is shared and must not be modified by callers.
+    """
+    global _checked  # pylint: disable=W0603
+
+    with _lock:
+        now = time.monotonic()
+        if _deltas is not None and not revalidate and now - _checked < INDEX_CACHE_TTL:
+            return _deltas
+
+        _revalidate()
+        _checked = now
+
+        return _deltas
+
+
+# -------------------------------------------------------------------
+# Index writer
+# Changes are written to the journal by a single greenlet, which waits
+# INDEX_WRITE_WINDOW seconds after a change for others to write with
+# it, so a burst of uploads makes one journal entry rather than one
+# each. Entries are written only if new, and snapshots only if they
+# replace the snapshot that was read, so that no instance overwrites
+# another's changes.
+# -------------------------------------------------------------------
+_writes = Queue()
+_writer = None
+
+
+def combine_changes(changes):
+    """Return a single change with the effect of `changes` applied in order."""
+    upsert = {}
+    delete = set()
+    for change in changes:
+        for seq in change["delete"]:
+            upsert.pop(seq, None)
+            delete.add(seq)
+        for entry in change["upsert"]:
+            upsert[entry["id"]] = entry
+            delete.discard(entry["id"])
+    return {"upsert": list(upsert.values()), "delete": sorted(delete)}
+
+
+def _write_changes():
+    global _checked  # pylint: disable=W0603
+
+    while True:
+        pending = [_writes.get()]
+        gevent.sleep(INDEX_WRITE_WINDOW)
+        while not _writes.empty():
+            pending.append(_writes.get())
+
+        key = (
+            get_journal_key(datetime.datetime.now(datetime.timezone.utc))
+            + "-"
+            + uuid.uuid4().hex[:8]
+            + ".json"
+        )
+        try:
+            change = combine_changes([change for change, _ in pending])
+            write_file(key, json.dumps(change), IfNoneMatch="*")
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("Error writing index change %s: %s", key, str(exc))
+            for _, written in pending:
+                written.set_exception(exc)
+            continue
+
+        logger.debug("Index change %s written for %s changes", key, len(pending))
+        with _lock:
+            _checked = 0.0  # read the change back with any others made meanwhile
+        for _, written in pending:
+            written.set(None)
+
+
+def journal_index(upsert=(), delete=()):
+    """Record index entries added or replaced (`upsert`), and the sequence
+    numbers of entries removed (`delete`), in the index journal. Returns once
+    they are written, raising any error writing them."""
+    global _writer  # pylint: disable=W0603
+
+    if _writer is None:
+        _writer = gevent.spawn(_write_changes)
+
+    written = AsyncResult()
+    _writes.put(
+        ({"upsert": list(upsert), "delete": [int(seq) for seq in delete]}, written)
+    )
+    written.get()
+
+
+def write_index(months, manifest, watermark, etag):
+    """Write a shard of the entries of each of `months` (a dict of month to
+    entries, no entries removing the month's shard) and an index file listing
+    them in place of those in `manifest`, the journal having been folded into
+    them up to key `watermark`, and keep it as the cached copy.
+
+    The index file is only replaced if it is still that with `etag`, whose
+    manifest is `manifest` (or only written if there is none, if `etag` is
+    None), raising PreconditionFailed otherwise."""
+    global _deltas, _manifest, _loaded, _etag, _watermark  # pylint: disable=W0603
+    global _changes, _checked  # pylint: disable=W0603
+
+    shards = dict(manifest["shards"])
+    for month, entries in months.items():
+        if not entries:
+            shards.pop(month, None)
+            continue
+
+        content = json.dumps(sorted(entries, key=lambda d: d["id"]))
+        digest = hashlib.sha256(content.encode()).hexdigest()[:16]
+        key = get_taric_index_shard_folder() + month + "-" + digest + ".json"
+        if shards.get(month, {}).get("key") != key:
+            write_file(key, content)
+            logger.debug("Index shard %s written", key)
+        shards[month] = get_shard_info(key, json.loads(content))
+
+    # shards no longer listed are retired, and removed once expired
+    now = datetime.datetime.now(datetime.timezone.utc)
+    listed = {shard["key"] for shard in shards.values()}
+    retired = {k: v for k, v in manifest["retired"].items() if k not in listed}
+    for shard in manifest["shards"].values():
+        if shard["key"] is not None and shard["key"] not in listed:
+            retired[shard["key"]] = now.strftime(JOURNAL_TIME_FORMAT)
+    expired = [
+        k
+        for k, v in retired.items()
+        if now
+        - datetime.datetime.strptime(v, JOURNAL_TIME_FORMAT).replace(
+            tzinfo=datetime.timezone.utc
+        )
+        > datetime.timedelta(seconds=RETIRED_SHARD_EXPIRY)
+    ]
+    for key in expired:
+        del retired[key]
+
+    manifest = {"shards": shards, "retired": retired}
+    with _lock:
+        etag = write_file(
+            get_taric_index_file(),
+            json.dumps(manifest),
+            metadata={"journal": watermark},
+            **({"IfNoneMatch": "*"} if etag is None else {"IfMatch": etag}),
+        )
+        _manifest = manifest
+        _loaded = {}
+        _etag = etag
+        _watermark = watermark
+        _changes = {k: v for k, v in _changes.items() if k > _watermark}
+        _deltas = ShardedIndex(shards, [_changes[k] for k in sorted(_changes)])
+        _checked = 0.0  # look for any other changes after the watermark
+
+    if expired:
+        logger.info("Removing %s replaced index shards", len(expired))
+        delete_files(expired)
+
+
+def save_index(all_deltas, watermark, etag):
+    """Persist `all_deltas` as the whole index, the journal having been folded
+    into it up to key `watermark`, and keep it as the cached copy.
+
+    The index file is only replaced if it is still that with `etag` (or only
+    written if there is none, if `etag` is None), raising PreconditionFailed
+    otherwise."""
+    manifest = {"shards": {}, "retired": {}}
+    if etag is not None:
+        with _lock:
+            manifest = _manifest if _etag == etag else None
+        if manifest is None:
+            content, current, _ = read_file_if_changed(get_taric_index_file(), None)
+            if current != etag:
+                raise PreconditionFailed(get_taric_index_file())
+            manifest, _ = read_manifest(content)
+
+    months = {month: [] for month in manifest["shards"]}
+    months.update(group_by_month(all_deltas))
+    write_index(months, manifest, watermark, etag)
+
+
+_paused = 0  # reasons for compaction to be held off in this instance
+
+
+def compact_index():
+    """Fold the settled changes in the journal into the shards they change,
+    and remove those folded in by the previous compaction."""
+    with _lock:
+        _revalidate()
+        previous_watermark = _watermark
+        cutoff = get_journal_key(
+            datetime.datetime.now(datetime.timezone.utc)
+            - datetime.timedelta(seconds=INDEX_JOURNAL_SETTLE)
+        )
+        settled = sorted(k for k in _changes if k < cutoff)
+        index = ShardedIndex(
+            _manifest["shards"], [_changes[k] for k in settled], _loaded
+        )
+        manifest = _manifest
+        etag = _etag
+
+    # an index file written before sharding is rewritten as shards
+    if settled or index.loaded:
+        months = index.changed_months() | set(index.loaded)
+        logger.info(
+            "Compacting %s index changes into %s shards", len(settled), len(months)
+        )
+        try:
+            write_index(
+                {month: index.month_entries(month) for month in months},
+                manifest,
+                settled[-1] if settled else previous_watermark,
+                etag,
+            )
+        except PreconditionFailed:
+            logger.info("Index replaced by another instance, not compacted")
+            return
+
+    folded = get_file_keys(get_taric_index_journal_folder())
+    folded = [k for k in folded if k <= previous_watermark]
+    if folded:
+        logger.info("Removing %s compacted index changes", len(folded))
+        delete_files(folded)
+
+
+@contextlib.contextmanager
+def compaction_paused():
+    """Hold off compaction in this instance, e.g. while the index is rebuilt,
+    as a rebuild only replaces the index file read when it started."""
+    global _paused  # pylint: disable=W0603
+
+    _paused = _paused + 1
+    try:
+        yield
+    finally:
+        _paused = _paused - 1
+
+
+def run_compactor():
+    """Compact the index every INDEX_COMPACT_INTERVAL seconds, forever."""
+    while True:
+        gevent.sleep(INDEX_COMPACT_INTERVAL)
+        if _paused:
+            logger.debug("Compaction paused")
+            continue
+        try:
+            compact_index()
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("Error compacting index: %s", str(exc))
@@ -0,0 +1,215 @@
+import datetime
+import json
+import logging
+import uuid
+
+import gevent
+from gevent.event import Event
+from gevent.queue import Queue
+
+from apifiles3 import PreconditionFailed
+from apifiles3 import delete_files
+from apifiles3 import get_job_filepath
+from apifiles3 import get_job_list
+from apifiles3 import get_job_upload_filepath
+from apifiles3 import open_file
+from apifiles3 import write_file
+from config import JOB_EXPIRY
+from config import JOB_STALE_AFTER
+from config import UPLOAD_JOB_WORKERS
+from taricupload import InvalidTaricFile
+
+logger = logging.getLogger("taricapi.jobs")
+
+
+# ---------------------------------------------------------------------------
+# Asynchronous upload jobs
+# The upload is stored as it is received and the request answered with a
+# job; validating, storing and indexing the file is left to a queue worked
+# by UPLOAD_JOB_WORKERS greenlets. The job is kept in S3, so that its status
+# can be asked of any instance.
+#
+# The queue is held in memory, so a job is updated while it is processed,
+# and an unfinished job not updated for JOB_STALE_AFTER seconds is deemed
+# abandoned by an instance that stopped and is taken over by another. Each
+# update is only written if the job is unchanged since its last, so a job
+# is only ever worked by the instance that last took it.
+# ---------------------------------------------------------------------------
+QUEUED = "queued"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+JOB_HEARTBEAT = JOB_STALE_AFTER / 3  # seconds between updates of a job worked
+
+_queue = Queue()
+_workers = []
+
+
+def is_valid_job_id(job_id):
+    try:
+        return uuid.UUID(hex=job_id).hex == job_id
+    except ValueError:
+        return False
+
+
+def new_job(seq):
+    now = datetime.datetime.now().isoformat()[:19]
+    return {
+        "id": uuid.uuid4().hex,
+        "seq": seq,
+        "status": QUEUED,
+        "created": now,
+        "updated": now,
+    }
+
+
+def save_job(job, etag=None):
+    """Save `job`, returning its ETag. The job is only replaced if it is still
+    that with `etag` (or only written if new, if `etag` is None), raising
+    PreconditionFailed otherwise."""
+    job["updated"] = datetime.datetime.now().isoformat()[:19]
+    return write_file(
+        get_job_filepath(job["id"]),
+        json.dumps(job),
+        **({"IfNoneMatch": "*"} if etag is None else {"IfMatch": etag}),
+    )
+
+
+def read_job(job_id):
+    """Return the job with `job_id` and its ETag, or None, None if there is
+    none."""
+    response = open_file(get_job_filepath(job_id))
+    if response is None:
+        return None, None
+    return json.loads(response["Body"].read()), response["ETag"]
+
+
+def get_job(job_id):
+    """Return the job with `job_id`, or None if there is none."""
+    return read_job(job_id)[0]
+
+
+def submit_job(job, func, *args):
+    """Save `job` and queue func(*args) to be run for it."""
+    queue_job(job, save_job(job), func, *args)
+
+
+def queue_job(job, etag, func, *args):
+    if not _workers:
+        logger.debug("Starting %s upload job workers", UPLOAD_JOB_WORKERS)
+        _workers.extend(gevent.spawn(_work) for _ in range(UPLOAD_JOB_WORKERS))
+
+    _queue.put((job, etag, func, args))
+
+
+def _keep_alive(job, etags, finished):
+    # update the job being worked until it is finished, so that it is not
+    # deemed abandoned
+    while not finished.wait(JOB_HEARTBEAT):
+        try:
+            etags[0] = save_job(job, etags[0])
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("Error updating job %s: %s", job["id"], str(exc))
+
+
+def _work():
+    for job, etag, func, args in _queue:
+        try:
+            job["status"] = PROCESSING
+            etag = save_job(job, etag)
+        except PreconditionFailed:
+            logger.info("Job %s taken over, not processed", job["id"])
+            continue
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("Error saving job %s: %s", job["id"], str(exc))
+            continue
+
+        logger.info("Processing job %s for file %s", job["id"], job["seq"])
+        etags = [etag]
+        finished = Event()
+        keep_alive = gevent.spawn(_keep_alive, job, etags, finished)
+
+        try:
+            func(*args)
+            job["status"] = DONE
+
+        except InvalidTaricFile as exc:
+            logger.debug("File failed schema check")
+            job["status"] = FAILED
+            job["message"] = "400 Failed schema check"
+            job["errors"] = exc.errors
+
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("Error processing job %s: %s", job["id"], str(exc))
+            job["status"] = FAILED
+            job["message"] = "500 Error saving file"
+
+        finally:
+            finished.set()
+            keep_alive.join()
+
+        try:
+            save_job(job, etags[0])
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("Error saving job %s: %s", job["id"], str(exc))
+
+
+def recover_jobs(func):
+    """Take over the unfinished jobs abandoned by instances that stopped,
+    queueing func(job_id, seq) for each again (or failing it, if its upload
+    is gone), and remove finished jobs JOB_EXPIRY seconds old and uploads
+    left without a job."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    files = {f["Key"]: f for f in get_job_list()}
+    expired = []
+
+    for key, file in files.items():
+        age = (now - file["LastModified"]).total_seconds()
+        if not key.endswith(".json"):
+            if age > JOB_STALE_AFTER and key[:-4] + ".json" not in files:
+                expired.append(key)
+            continue
+
+        if age <= JOB_STALE_AFTER:
+            continue
+
+        job_id = key[key.rindex("/") + 1 : -len(".json")]
+        job, etag = read_job(job_id)
+        if job is None:
+            continue
+
+        upload = get_job_upload_filepath(job_id)
+        if job["status"] in (DONE, FAILED):
+            if age > JOB_EXPIRY:
+                expired.append(key)
+                if upload in files:
+                    expired.append(upload)
+            continue
+
+        try:
+            if upload in files:
+                logger.info("Taking over abandoned job %s", job_id)
+                job["status"] = QUEUED
+                queue_job(job, save_job(job, etag), func, job_id, job["seq"])
+            else:
+                logger.info("Failing abandoned job %s, its upload is gone", job_id)
+                job["status"] = FAILED
+                job["message"] = "500 Error saving file"
+                save_job(job, etag)
+        except PreconditionFailed:
+            logger.info("Job %s updated by another instance", job_id)
+
+    if expired:
+        logger.info("Removing %s expired job files", len(expired))
+        delete_files(expired)
+
+
+def run_job_recovery(func):
+    """Recover jobs every JOB_STALE_AFTER seconds, forever."""
+    while True:
+        try:
+            recover_jobs(func)
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("Error recovering jobs: %s", str(exc))
+        gevent.sleep(JOB_STALE_AFTER)
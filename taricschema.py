@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+
+from lxml import etree
+
+from config import WORKER_THREADS
+from offload import offload
+
+logger = logging.getLogger("taricapi.schema")
+
+ENVELOPE_NAMESPACE = "urn:publicid:-:DGTAXUD:GENERAL:ENVELOPE:1.0"
+
+MAX_SCHEMA_ERRORS = 100  # errors reported for a document that fails validation
+
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------------------------------------------------------------------------
+# Registry of compiled XSD schemas
+# Each schema is parsed and compiled once, when the process starts, and
+# selected by the namespace of the document's root element. Taric files are
+# envelopes, validated against taric3.xsd, which imports envelope.xsd for
+# the envelope itself and adds the taric records carried in it.
+# ---------------------------------------------------------------------------
+class Schema:
+    """A compiled XSD schema. A compiled schema keeps the errors of its last
+    validation, so each validation running at once has a compiled copy of its
+    own, compiled when first needed and reused after. Validation is run on
+    the worker threads, as it can take some seconds for a large file, so no
+    more than WORKER_THREADS validations (and copies) are needed at once."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.free = [self.compile()]  # compiled copies not in use
+        self.slots = threading.BoundedSemaphore(max(WORKER_THREADS, 1))
+
+    def compile(self):
+        return etree.XMLSchema(etree.parse(os.path.join(SCHEMA_DIR, self.filename)))
+
+    def validate(self, xml):
+        """Validate `xml`, a parsed document, returning a list of errors which
+        is empty if it is valid."""
+        with self.slots:
+            return self._validate(xml)
+
+    def _validate(self, xml):
+        try:
+            xsd = self.free.pop()
+        except IndexError:
+            logger.debug("Compiling another copy of %s", self.filename)
+            xsd = offload(self.compile)
+
+        try:
+            if offload(xsd.validate, xml):
+                return []
+            return [
+                {"line": e.line, "column": e.column, "message": e.message}
+                for e in list(xsd.error_log)[:MAX_SCHEMA_ERRORS]
+            ]
+        finally:
+            self.free.append(xsd)
+
+
+def load_schemas():
+    schemas = {ENVELOPE_NAMESPACE: Schema("taric3.xsd")}
+    logger.debug("Compiled %s schemas", len(schemas))
+    return schemas
+
+
+_schemas = load_schemas()
+
+
+def get_namespace(xml):
+    return etree.QName(xml.getroot()).namespace
+
+
+def validate(xml):
+    """Validate `xml`, a parsed document, against the schema for the namespace
+    of its root element, returning a list of errors which is empty if it is
+    valid."""
+    namespace = get_namespace(xml)
+    if namespace not in _schemas:
+        return [{"line": 1, "column": 0, "message": f"No schema for {namespace}"}]
+
+    errors = _schemas[namespace].validate(xml)
+    if errors:
+        logger.info("XML failed validation against %s", _schemas[namespace].filename)
+        logger.debug("%s", errors)
+    else:
+        logger.info("XML validates against %s", _schemas[namespace].filename)
+    return errors
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import tempfile
+import zlib
+
+from botocore.exceptions import ClientError
+from lxml import etree
+
+from apifiles3 import StreamingUpload
+from apifiles3 import get_taric_filepath
+from apifiles3 import put_compressed_taric_file
+from apifiles3 import stream_body
+from config import STREAM_CHUNK_SIZE
+from offload import offload
+from taricindex import get_index
+from taricschema import ENVELOPE_NAMESPACE
+from taricschema import get_namespace
+from taricschema import validate
+
+logger = logging.getLogger("taricapi.upload")
+
+
+class InvalidTaricFile(Exception):
+    """The uploaded file is not XML or does not validate against the taric3
+    schema. `errors` lists where and why, as line, column and message."""
+
+    def __init__(self, errors):
+        super().__init__(errors[0]["message"])
+        self.errors = errors
+
+
+class InvalidContentEncoding(Exception):
+    """The uploaded file could not be decoded as its Content-Encoding said."""
+
+
+class GzipReader:
+    """Readable file of the decompressed content of `file`, read from gzip
+    compressed `file` a chunk at a time, so that neither is held in full."""
+
+    def __init__(self, file):
+        self.file = file
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip
+        self.between_members = False
+
+    def read(self, size=-1):
+        data = bytearray()
+        while size < 0 or len(data) < size:
+            if self.decompressor.eof:
+                # a gzip file may hold several members, one after another
+                compressed = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self.between_members = True
+            else:
+                compressed = self.decompressor.unconsumed_tail
+
+            if not compressed:
+                compressed = self.file.read(STREAM_CHUNK_SIZE)
+                if not compressed:
+                    if not self.between_members:
+                        raise InvalidContentEncoding("gzip content is truncated")
+                    break
+
+            max_length = STREAM_CHUNK_SIZE if size < 0 else size - len(data)
+            try:
+                data.extend(self.decompressor.decompress(compressed, max_length))
+            except zlib.error as exc:
+                raise InvalidContentEncoding(str(exc)) from exc
+            self.between_members = False
+
+        return bytes(data)
+
+
+def get_syntax_errors(exc):
+    line, column = exc.position
+    return [{"line": line, "column": column, "message": exc.msg}]
+
+
+def validate_taric_file(xml):
+    """Raise InvalidTaricFile unless `xml`, an already parsed document, is a
+    taric envelope valid against its schema."""
+    if get_namespace(xml) != ENVELOPE_NAMESPACE:
+        logger.info("XML is not a taric envelope")
+        raise InvalidTaricFile(
+            [{"line": 1, "column": 0, "message": "Not a taric envelope"}]
+        )
+
+    errors = validate(xml)
+    if errors:
+        raise InvalidTaricFile(errors)
+
+
+def get_stored_entry(seq, modtime=None):
+    """Return the index entry of the file stored for seq, if an upload with
+    `modtime` (if given) may be identical to it, otherwise None."""
+    # revalidate, as another instance may have stored the file since our last read
+    index_entry = get_index(revalidate=True).get(seq)
+    if index_entry is None or modtime not in (None, index_entry["issue_date"]):
+        return None
+    return index_entry
+
+
+# ---------------------------------------------------------------------------
+# Single pass upload
+# The uploaded file is read once, each chunk being checksummed and gzip
+# compressed (on the worker threads), fed to the XML parser and sent on to
+# S3 as it arrives, rather than stored, read back to validate and read again
+# to compress. The file only replaces any existing copy once it has been
+# validated.
+# A retried upload is often identical to the file already stored, so while
+# the upload may be that file (it is no larger) its chunks are only
+# checksummed and held back, to be compressed, parsed and sent on once it
+# is known to differ - an unchanged file is neither compressed nor sent.
+# ---------------------------------------------------------------------------
+def spool():
+    return tempfile.SpooledTemporaryFile(max_size=STREAM_CHUNK_SIZE * 8)
+
+
+def store_taric_file(file, seq, modtime=None):
+    """Validate and store the taric file for seq read from `file`, along with
+    its gzip compressed copy. Returns False, with nothing stored, if the file
+    is identical to that already stored (as a retried upload often is),
+    otherwise True.
+
+    Raises InvalidTaricFile, with nothing stored, if it fails validation."""
+    logger.debug("Storing file %s", seq)
+
+    hash_sha512 = hashlib.sha512()
+    size = 0
+    parser = etree.XMLParser()
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip
+    upload = StreamingUpload(get_taric_filepath(seq))
+    stored_entry = get_stored_entry(seq, modtime)
+
+    def checksum_and_compress(chunk):
+        hash_sha512.update(chunk)
+        return compressor.compress(chunk)
+
+    def store(chunk, compress=checksum_and_compress):
+        compressed.write(offload(compress, chunk))
+        parser.feed(chunk)
+        upload.write(chunk)
+
+    def release(held):
+        # the upload differs from the stored file: store the chunks held back
+        logger.debug("File %s differs from that stored", seq)
+        held.seek(0)
+        for chunk in stream_body(held):
+            store(chunk, compressor.compress)
+
+    with spool() as compressed, spool() as held:
+        try:
+            for chunk in stream_body(file):
+                size = size + len(chunk)
+                if stored_entry is not None:
+                    if size <= stored_entry["size"]:
+                        offload(hash_sha512.update, chunk)
+                        held.write(chunk)
+                        continue
+
+                    release(held)
+                    stored_entry = None
+
+                store(chunk)
+
+            if stored_entry is not None:
+                if (
+                    size == stored_entry["size"]
+                    and hash_sha512.hexdigest() == stored_entry["sha512"]
+                ):
+                    logger.info("File %s is unchanged", seq)
+                    upload.abort()
+                    return False
+
+                release(held)
+
+            xml = parser.close().getroottree()
+            validate_taric_file(xml)
+
+            metadata = {"sha512": hash_sha512.hexdigest(), "size": str(size)}
+            if modtime is not None:
+                logger.debug("Setting Metadata modified to %s", modtime)
+                metadata["modified"] = modtime
+            upload.commit(metadata)
+
+        except etree.XMLSyntaxError as exc:
+            upload.abort()
+            logger.info("Unable to parse file as XML")
+            raise InvalidTaricFile(get_syntax_errors(exc)) from exc
+
+        except BaseException:
+            upload.abort()
+            raise
+
+        # Keep a compressed copy for clients that accept gzip - the file is
+        # still served (uncompressed) without it
+        try:
+            compressed.write(compressor.flush())
+            compressed.seek(0)
+            put_compressed_taric_file(seq, compressed, metadata["sha512"])
+        except (IOError, ClientError) as exc:
+            logger.error("Error saving compressed file %s.xml: %s", seq, str(exc))
+
+    return True
@@ -0,0 +1,160 @@
+import hashlib
+import io
+import threading
+import time
+
+import pytest
+
+import apifiles3
+from config import STREAM_CHUNK_SIZE
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3Client:
+    """Stands in for the boto3 S3 client, counting get_object calls. Each
+    call is slow enough for concurrent readers to arrive while it is open."""
+
+    class exceptions:  # pylint: disable=C0103
+        NoSuchKey = NoSuchKey
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.get_object_calls = 0
+
+    def get_object(
+        self, Bucket, Key, Range=None, **kwargs
+    ):  # pylint: disable=C0103, W0613
+        self.get_object_calls += 1
+        time.sleep(0.2)
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+
+        body = self.objects[Key]
+        if Range is not None:
+            body = body[int(Range[len("bytes=") : -1]) :]
+        return {
+            "Body": io.BytesIO(body),
+            "ContentLength": len(body),
+            "ETag": '"{}"'.format(hashlib.md5(self.objects[Key]).hexdigest()),
+        }
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    client = FakeS3Client({"taricfiles/180251.xml": b"x" * (STREAM_CHUNK_SIZE * 2 + 5)})
+    monkeypatch.setattr(apifiles3, "session", lambda: client)
+    monkeypatch.setattr(apifiles3, "_shared_reads", {})
+    return client
+
+
+def read_concurrently(filepath, n):
+    """Read filepath through open_file_shared from n threads at once, returning
+    what each read."""
+    results = [None] * n
+
+    def read(i):
+        response = apifiles3.open_file_shared(filepath)
+        if response is not None:
+            results[i] = b"".join(apifiles3.stream_body(response["Body"]))
+
+    threads = [threading.Thread(target=read, args=[i]) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def test_concurrent_reads_share_one_get(s3_client):
+    """Test that N concurrent reads of an object make a single S3 GET, and
+    that every reader gets the whole object."""
+    results = read_concurrently("taricfiles/180251.xml", 10)
+
+    assert s3_client.get_object_calls == 1
+    assert results == [s3_client.objects["taricfiles/180251.xml"]] * 10
+
+
+def test_concurrent_reads_of_missing_object_share_one_get(s3_client):
+    """Test that concurrent reads of a missing object make a single S3 GET and
+    all find that it does not exist."""
+    results = read_concurrently("taricfiles/180252.xml", 10)
+
+    assert s3_client.get_object_calls == 1
+    assert results == [None] * 10
+
+
+def test_reads_after_completion_get_again(s3_client):
+    """Test that a read starting after an earlier read has completed makes its
+    own GET, so it sees the object as it is now."""
+    read_concurrently("taricfiles/180251.xml", 1)
+    read_concurrently("taricfiles/180251.xml", 1)
+
+    assert s3_client.get_object_calls == 2
+
+
+def test_chunks_are_not_read_ahead_of_readers(s3_client):
+    """Test that the body is read as it is asked for, and chunks dropped once
+    read, so a stalled reader holds at most the chunk it is reading."""
+    response = apifiles3.open_file_shared("taricfiles/180251.xml")
+    response["Body"].read(10)
+
+    assert len(response["Body"].shared_read.chunks) <= 1
+
+
+def test_reader_left_behind_reads_the_rest_itself(s3_client, monkeypatch):
+    """Test that chunks are dropped once a reader is SHARED_READ_WINDOW behind
+    the furthest ahead, the reader left behind reading the rest with a GET of
+    its own."""
+    monkeypatch.setattr(apifiles3, "SHARED_READ_WINDOW", 1)
+    ahead = apifiles3.open_file_shared("taricfiles/180251.xml")["Body"]
+    behind = apifiles3.open_file_shared("taricfiles/180251.xml")["Body"]
+
+    assert behind.read(10) == b"x" * 10
+    assert b"".join(apifiles3.stream_body(ahead)) == (
+        s3_client.objects["taricfiles/180251.xml"]
+    )
+    assert len(ahead.shared_read.chunks) <= 1
+    assert b"x" * 10 + b"".join(apifiles3.stream_body(behind)) == (
+        s3_client.objects["taricfiles/180251.xml"]
+    )
+    assert s3_client.get_object_calls == 2
+
+
+def test_abandoned_read_is_not_joined(s3_client):
+    """Test that a read abandoned by its only reader is closed, so that a read
+    of the object after it is overwritten gets the new object."""
+    body = apifiles3.open_file_shared("taricfiles/180251.xml")["Body"]
+    body.read(10)
+    body.close()
+    s3_client.objects["taricfiles/180251.xml"] = b"new"
+
+    assert read_concurrently("taricfiles/180251.xml", 1) == [b"new"]
+    assert s3_client.get_object_calls == 2
+
+
+def test_read_of_another_etag_is_not_joined(s3_client):
+    """Test that a read still in progress is not joined by a caller expecting
+    the object to have another ETag, e.g. once it is overwritten."""
+    first = apifiles3.open_file_shared("taricfiles/180251.xml")
+    s3_client.objects["taricfiles/180251.xml"] = b"new"
+    etag = '"{}"'.format(hashlib.md5(b"new").hexdigest())
+    second = apifiles3.open_file_shared("taricfiles/180251.xml", etag)
+
+    assert second["Body"].read() == b"new"
+    assert first["Body"].read(3) == b"xxx"
+    assert s3_client.get_object_calls == 2
+
+
+def test_old_read_is_not_joined(s3_client, monkeypatch):
+    """Test that a read started more than SHARED_READ_JOIN_AGE seconds ago is
+    not joined."""
+    monkeypatch.setattr(apifiles3, "SHARED_READ_JOIN_AGE", 0.1)
+    apifiles3.open_file_shared("taricfiles/180251.xml")
+    s3_client.objects["taricfiles/180251.xml"] = b"new"
+
+    assert read_concurrently("taricfiles/180251.xml", 1) == [b"new"]
+    assert s3_client.get_object_calls == 2
@@ -0,0 +1,89 @@
+import pytest
+
+import apifiles3
+from config import UPLOAD_PART_SIZE
+
+
+class FakeS3Client:
+    """Stands in for the boto3 S3 client, keeping objects and multipart
+    uploads in memory."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def put_object(self, Body, Bucket, Key, Metadata):  # pylint: disable=C0103, W0613
+        self.objects[Key] = (Body, Metadata)
+
+    def create_multipart_upload(
+        self, Bucket, Key, Metadata
+    ):  # pylint: disable=C0103, W0613
+        uploadid = str(len(self.uploads))
+        self.uploads[uploadid] = {}
+        return {"UploadId": uploadid}
+
+    def upload_part(  # pylint: disable=C0103, W0613
+        self, Bucket, Key, UploadId, PartNumber, Body
+    ):
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(  # pylint: disable=C0103, W0613
+        self, Bucket, Key, UploadId, MultipartUpload
+    ):
+        parts = self.uploads.pop(UploadId)
+        body = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+        self.objects[Key] = (body, {})
+
+    def abort_multipart_upload(
+        self, Bucket, Key, UploadId
+    ):  # pylint: disable=C0103, W0613
+        del self.uploads[UploadId]
+
+    def copy_object(  # pylint: disable=C0103, W0613
+        self, Bucket, CopySource, Key, Metadata, MetadataDirective
+    ):
+        self.objects[Key] = (self.objects[CopySource["Key"]][0], Metadata)
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    client = FakeS3Client()
+    monkeypatch.setattr(apifiles3, "session", lambda: client)
+    return client
+
+
+def test_small_file_is_put_in_one_request(s3_client):
+    upload = apifiles3.StreamingUpload("taricfiles/180251.xml")
+    upload.write(b"abc")
+    upload.write(b"def")
+    assert s3_client.objects == {}
+
+    upload.commit({"size": "6"})
+    assert s3_client.objects == {"taricfiles/180251.xml": (b"abcdef", {"size": "6"})}
+    assert s3_client.uploads == {}
+
+
+def test_large_file_is_uploaded_in_parts(s3_client):
+    data = bytes(range(256)) * (UPLOAD_PART_SIZE // 256 * 2 + 20)
+    upload = apifiles3.StreamingUpload("taricfiles/180251.xml")
+    for i in range(0, len(data), 1024):
+        upload.write(data[i : i + 1024])
+    assert len(s3_client.uploads["0"]) == 2
+    assert s3_client.objects == {}
+
+    upload.commit({"size": str(len(data))})
+    assert s3_client.objects == {
+        "taricfiles/180251.xml": (data, {"size": str(len(data))})
+    }
+    assert s3_client.uploads == {}
+
+
+def test_abort_stores_nothing(s3_client):
+    upload = apifiles3.StreamingUpload("taricfiles/180251.xml")
+    upload.write(b"x" * (UPLOAD_PART_SIZE + 1))
+    assert s3_client.uploads
+
+    upload.abort()
+    assert s3_client.uploads == {}
+    assert s3_client.objects == {}
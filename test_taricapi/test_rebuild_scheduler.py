@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+import taricapi
+
+
+@pytest.fixture
+def release():
+    return threading.Event()
+
+
+@pytest.fixture
+def rebuilds(monkeypatch, release):
+    """Record the rebuilds run, in place of rebuilding the index. Each waits
+    for `release` to be set."""
+    rebuilds = []
+
+    def rebuild_index(nocheck, full=False):
+        rebuilds.append(full)
+        release.wait()
+
+    monkeypatch.setattr(taricapi, "rebuild_index", rebuild_index)
+    monkeypatch.setattr(taricapi, "rebuild_running", False)
+    monkeypatch.setattr(taricapi, "rebuild_pending", None)
+    return rebuilds
+
+
+def wait_for_rebuilds():
+    for _ in range(100):
+        with taricapi.rebuild_lock:
+            if not taricapi.rebuild_running:
+                return
+        time.sleep(0.01)
+    raise AssertionError("rebuilds did not finish")
+
+
+def test_rebuilds_asked_for_while_one_runs_follow_as_one(rebuilds, release):
+    """Test that one rebuild runs at a time, and that those asked for while
+    it runs are made as a single rebuild after it - a full one, if any of
+    them asked for a full rebuild."""
+    assert taricapi.schedule_rebuild() is True
+    assert taricapi.schedule_rebuild() is False
+    assert taricapi.schedule_rebuild(full=True) is False
+    assert taricapi.schedule_rebuild() is False
+
+    release.set()
+    wait_for_rebuilds()
+
+    assert rebuilds == [False, True]
+    assert taricapi.rebuild_pending is None
+
+
+def test_rebuild_after_the_last_finished_starts_at_once(rebuilds, release):
+    release.set()
+    assert taricapi.schedule_rebuild() is True
+    wait_for_rebuilds()
+
+    assert taricapi.schedule_rebuild(full=True) is True
+    wait_for_rebuilds()
+
+    assert rebuilds == [False, True]
+
+
+def test_failed_rebuild_is_reported_and_does_not_stop_the_next(rebuilds, monkeypatch):
+    def rebuild_index(nocheck, full=False):
+        raise IOError("S3 unavailable")
+
+    monkeypatch.setattr(taricapi, "rebuild_index", rebuild_index)
+    assert taricapi.schedule_rebuild() is True
+    wait_for_rebuilds()
+
+    assert taricapi.rebuild_progress["last_result"] == "failed"
+    assert taricapi.schedule_rebuild() is True
+    wait_for_rebuilds()
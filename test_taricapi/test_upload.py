@@ -0,0 +1,84 @@
+import gzip
+import os
+
+import pytest
+
+import taricapi
+import taricupload
+
+XML_FILE = os.path.join(os.path.dirname(__file__), "..", "tests", "DIT123456.xml")
+
+
+class FakeStreamingUpload:
+    """Stands in for StreamingUpload, keeping the files committed in
+    `uploads` rather than storing them in S3."""
+
+    uploads = {}
+
+    def __init__(self, filename, metadata=None):  # pylint: disable=W0613
+        self.filename = filename
+        self.data = b""
+
+    def write(self, data):
+        self.data = self.data + data
+
+    def commit(self, metadata=None):  # pylint: disable=W0613
+        self.uploads[self.filename] = self.data
+
+    def abort(self):
+        self.data = b""
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    monkeypatch.setattr(FakeStreamingUpload, "uploads", {})
+    monkeypatch.setattr(taricupload, "StreamingUpload", FakeStreamingUpload)
+    monkeypatch.setattr(taricupload, "get_stored_entry", lambda seq, modtime: None)
+    monkeypatch.setattr(taricupload, "put_compressed_taric_file", lambda *args: None)
+    monkeypatch.setattr(taricapi, "is_auth_upload", lambda request: True)
+    monkeypatch.setattr(taricapi, "update_index", lambda *seqs: None)
+    return FakeStreamingUpload.uploads
+
+
+@pytest.fixture
+def xml():
+    with open(XML_FILE, "rb") as f:
+        return f.read()
+
+
+def put_gzip(data):
+    return taricapi.app.test_client().put(
+        "/api/v1/taricfiles/180251",
+        data=data,
+        headers={"Content-Encoding": "gzip"},
+    )
+
+
+def test_gzip_upload_of_several_members_stores_them_all(uploads, xml):
+    """Test that a gzip compressed upload made of several members (as
+    concatenated gzip files are) stores the content of every member."""
+    r = put_gzip(gzip.compress(xml[:100]) + gzip.compress(xml[100:]))
+
+    assert r.status_code == 200
+    assert uploads == {taricapi.get_taric_filepath("180251"): xml}
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        pytest.param(lambda xml: gzip.compress(xml)[:-3], id="truncated"),
+        pytest.param(
+            lambda xml: gzip.compress(xml[:100]) + gzip.compress(xml[100:])[:20],
+            id="truncated second member",
+        ),
+        pytest.param(lambda xml: xml, id="not gzip"),
+    ],
+)
+def test_gzip_upload_that_cannot_be_decoded_is_rejected(uploads, xml, data):
+    """Test that a gzip compressed upload that is truncated, or not gzip at
+    all, is answered 400 with nothing stored."""
+    r = put_gzip(data(xml))
+
+    assert r.status_code == 400
+    assert r.data == b"400 Bad request [invalid content encoding]"
+    assert uploads == {}
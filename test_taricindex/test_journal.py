@@ -0,0 +1,35 @@
+import datetime
+
+from taricindex import apply_changes
+from taricindex import get_journal_key
+
+
+def entry(seq, sha512="a"):
+    return {"id": seq, "sha512": sha512}
+
+
+def test_changes_are_applied_in_order():
+    entries = [entry(180251), entry(180252)]
+    changes = [
+        {"upsert": [entry(180253)], "delete": []},
+        {"upsert": [entry(180252, "b")], "delete": [180251]},
+        {"upsert": [], "delete": [180253]},
+        {"upsert": [entry(180253, "c")], "delete": []},
+    ]
+
+    assert sorted(apply_changes(entries, changes), key=lambda d: d["id"]) == [
+        entry(180252, "b"),
+        entry(180253, "c"),
+    ]
+
+
+def test_deleting_an_unindexed_file_changes_nothing():
+    assert apply_changes([entry(180251)], [{"delete": [180252]}]) == [entry(180251)]
+
+
+def test_journal_keys_sort_in_time_order():
+    earlier = datetime.datetime(2024, 1, 31, 23, 59, 59, 999999)
+    later = datetime.datetime(2024, 2, 1)
+
+    assert get_journal_key(earlier) < get_journal_key(later)
+    assert get_journal_key(later) < get_journal_key(later) + "-00000000.json"
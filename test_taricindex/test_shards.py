@@ -0,0 +1,60 @@
+from taricindex import DeltaIndex
+from taricindex import ShardedIndex
+from taricindex import get_shard_info
+
+
+def entry(seq, issue_date, sha512="a"):
+    return {"id": seq, "issue_date": issue_date + "T00:00:00", "sha512": sha512}
+
+
+def sharded_index(changes=()):
+    loaded = {
+        "2024-01": DeltaIndex(
+            [entry(180251, "2024-01-30"), entry(180252, "2024-01-31")]
+        ),
+        "2024-02": DeltaIndex([entry(180253, "2024-02-01")]),
+    }
+    shards = {month: get_shard_info(None, d.entries) for month, d in loaded.items()}
+    return ShardedIndex(shards, list(changes), loaded)
+
+
+def ids(entries):
+    return [d["id"] for d in entries]
+
+
+def test_lookups_span_shards():
+    index = sharded_index()
+
+    assert index.get("180253")["issue_date"] == "2024-02-01T00:00:00"
+    assert index.get("180254") is None
+    assert ids(index.issued_between("2024-01-31", "2024-02-01")) == [180252, 180253]
+    assert ids(index.after_seq("180251")) == [180252, 180253]
+
+
+def test_journal_changes_are_applied_over_shards():
+    index = sharded_index(
+        [
+            {"upsert": [entry(180252, "2024-02-02", "b")], "delete": [180251]},
+            {"upsert": [entry(180254, "2024-03-01")], "delete": []},
+        ]
+    )
+
+    assert index.get("180251") is None
+    assert ids(index.issued_on("2024-01-31")) == []
+    assert ids(index.issued_between("2024-02-01", "2024-03-31")) == [
+        180252,
+        180253,
+        180254,
+    ]
+    assert ids(index.seq_between("180250", "180253")) == [180252, 180253]
+
+
+def test_changed_months_include_those_entries_leave():
+    index = sharded_index(
+        [{"upsert": [entry(180252, "2024-02-02", "b")], "delete": []}]
+    )
+
+    assert index.changed_months() == {"2024-01", "2024-02"}
+    assert ids(index.month_entries("2024-01")) == [180251]
+    assert ids(index.month_entries("2024-02")) == [180252, 180253]
+    assert ids(index.month_entries("2024-03")) == []
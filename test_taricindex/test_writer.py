@@ -0,0 +1,93 @@
+import json
+
+import gevent
+import pytest
+
+import taricindex
+from taricindex import combine_changes
+from taricindex import journal_index
+
+
+def entry(seq, sha512="a"):
+    return {"id": seq, "sha512": sha512}
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """Record the journal entries written, in place of writing them to S3."""
+    written = []
+
+    def write_file(filepath, jsoncontent, metadata=None, **kwargs):
+        written.append((filepath, json.loads(jsoncontent), kwargs))
+        return '"etag"'
+
+    monkeypatch.setattr(taricindex, "write_file", write_file)
+    monkeypatch.setattr(taricindex, "INDEX_WRITE_WINDOW", 0.01)
+    yield written
+
+    if taricindex._writer is not None:
+        taricindex._writer.kill()
+        taricindex._writer = None
+
+
+def test_combined_changes_keep_the_last_change_to_each_file():
+    changes = [
+        {"upsert": [entry(180251), entry(180252)], "delete": []},
+        {"upsert": [entry(180253)], "delete": [180251]},
+        {"upsert": [entry(180251, "b")], "delete": [180252]},
+    ]
+
+    combined = combine_changes(changes)
+
+    assert sorted(combined["upsert"], key=lambda d: d["id"]) == [
+        entry(180251, "b"),
+        entry(180253),
+    ]
+    assert combined["delete"] == [180252]
+
+
+def test_changes_made_together_are_written_as_one(written):
+    """Test that changes journalled within INDEX_WRITE_WINDOW of each other
+    make a single journal entry, written only if new, and that each caller
+    returns once it is written."""
+    callers = [
+        gevent.spawn(journal_index, upsert=[entry(180251)]),
+        gevent.spawn(journal_index, upsert=[entry(180252)]),
+        gevent.spawn(journal_index, delete=["180250"]),
+    ]
+    gevent.joinall(callers, raise_error=True)
+
+    assert len(written) == 1
+    key, change, kwargs = written[0]
+    assert key.startswith(taricindex.get_taric_index_journal_folder())
+    assert change == {"upsert": [entry(180251), entry(180252)], "delete": [180250]}
+    assert kwargs == {"IfNoneMatch": "*"}
+
+
+def test_changes_made_apart_are_written_apart(written):
+    journal_index(upsert=[entry(180251)])
+    journal_index(upsert=[entry(180252)])
+
+    assert [change["upsert"] for _, change, _ in written] == [
+        [entry(180251)],
+        [entry(180252)],
+    ]
+    assert written[0][0] < written[1][0]
+
+
+def test_error_writing_changes_is_raised_to_every_caller(written, monkeypatch):
+    def write_file(filepath, jsoncontent, metadata=None, **kwargs):
+        raise IOError("S3 unavailable")
+
+    monkeypatch.setattr(taricindex, "write_file", write_file)
+    callers = [
+        gevent.spawn(journal_index, upsert=[entry(180251)]),
+        gevent.spawn(journal_index, upsert=[entry(180252)]),
+    ]
+    gevent.joinall(callers)
+
+    assert [type(caller.exception) for caller in callers] == [IOError, IOError]
+
+    # the writer carries on with later changes
+    monkeypatch.setattr(taricindex, "write_file", lambda *args, **kwargs: '"etag"')
+    journal_index(upsert=[entry(180253)])
@@ -77,10 +77,47 @@ test "taricdeltas - All correct -> expect 200"
 out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null $APIURLLIST/2019-02-05)
 assert "200" "$out"
 
+test "taricdeltas - Date range -> expect 200"
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null "$APIURLLIST?from=2019-02-01&to=2019-02-28")
+assert "200" "$out"
+
+test "taricdeltas - After sequence -> expect 200"
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null "$APIURLLIST?after_seq=180250")
+assert "200" "$out"
+
+test "taricdeltas - After sequence with date range -> expect 400"
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null "$APIURLLIST?after_seq=180250&from=2019-02-01")
+assert "400" "$out"
+
+test "taricdeltas - Reversed date range -> expect 400"
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null "$APIURLLIST?from=2019-02-28&to=2019-02-01")
+assert "400" "$out"
+
 test "taricfiles - All correct -> expect 200"
 out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null $APIURLFILE/180251)
 assert "200" "$out"
 
+test "taricfiles - Byte range -> expect 206"
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -H "Range: bytes=0-99" -w "%{http_code}" -o /dev/null $APIURLFILE/180251)
+assert "206" "$out"
+
+test "taricfiles - Unsatisfiable byte range -> expect 416"
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -H "Range: bytes=100000-" -w "%{http_code}" -o /dev/null $APIURLFILE/180251)
+assert "416" "$out"
+
+test "taricfiles - Current ETag in If-None-Match -> expect 304"
+etag=$(curl -s -I -H "X-API-KEY: abc123" $APIURLFILE/180251 | grep -i "^ETag:" | cut -d' ' -f2 | tr -d '\r')
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -H "If-None-Match: $etag" -w "%{http_code}" -o /dev/null $APIURLFILE/180251)
+assert "304" "$out"
+
+test "taricfiles/bulk - Sequence range -> expect 200"
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null "$APIURLFILE/bulk?from=180251&to=180251")
+assert "200" "$out"
+
+test "taricfiles/bulk - Invalid sequence range -> expect 400"
+out=$(curl -s -i -H "X-API-KEY: abc123" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null "$APIURLFILE/bulk?from=123")
+assert "400" "$out"
+
 test "X-Robots-Tag header is present on responses -> expect noindex, nofollow"
 out=$(curl -s -i -I -H "X-API-KEY: abc123" $APIURLFILE/180251 | grep "X-Robots-Tag: noindex, nofollow")
 assert "0" "$?"
@@ -103,6 +140,38 @@ test "Invalid XML file upload -> expect 400"
 out=$(curl -s -i -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" --form file=@tests/invalid.txt -w "%{http_code}" -o /dev/null $APIURLFILE/123456)
 assert "400" "$out"
 
+test "Schema invalid XML file upload -> expect errors as JSON"
+out=$(curl -s -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" --form file=@tests/invalid.xml -w "%{http_code} %{content_type}" -o /dev/null $APIURLFILE/123456)
+assert "400 application/json" "$out"
+
+test "Asynchronous file upload -> expect 202"
+out=$(curl -s -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" --form file=@tests/DIT123456.xml -w "%{http_code}" -o /dev/null "$APIURLFILE/180251?modtime=2019-02-05T12:00:00.000&async=true")
+assert "202" "$out"
+
+test "Invalid job id -> expect 400"
+out=$(curl -s -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null ${TTF_TEST_URL}/api/v1/jobs/invalid)
+assert "400" "$out"
+
+test "Batch file upload -> expect 200"
+out=$(curl -s -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" --form 180251=@tests/DIT123456.xml -w "%{http_code}" -o /dev/null $APIURLFILE/batch)
+assert "200" "$out"
+
+test "Batch file upload with invalid file -> expect 207"
+out=$(curl -s -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" --form 180251=@tests/DIT123456.xml --form 123456=@tests/invalid.xml -w "%{http_code}" -o /dev/null $APIURLFILE/batch)
+assert "207" "$out"
+
+test "Correct file upload as request body -> expect 200"
+out=$(curl -s -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -T tests/DIT123456.xml -w "%{http_code}" -o /dev/null $APIURLFILE/180251?modtime=2019-02-05T12:00:00.000)
+assert "200" "$out"
+
+test "Gzip compressed file upload as request body -> expect 200"
+out=$(gzip -c tests/DIT123456.xml | curl -s -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -H "Content-Encoding: gzip" -T - -w "%{http_code}" -o /dev/null $APIURLFILE/180251?modtime=2019-02-05T12:00:00.000)
+assert "200" "$out"
+
+test "Rebuild index status -> expect 200"
+out=$(curl -s -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" -w "%{http_code}" -o /dev/null ${TTF_TEST_URL}/api/v1/rebuildindex)
+assert "200" "$out"
+
 test "Missing file sequence upload -> expect 400"
 out=$(curl -s -i -H "X-API-KEY: def456" -H "X-Forwarded-For: 1.2.3.4, 127.0.0.1" --form file=@tests/DIT123456.xml -w "%{http_code}" -o /dev/null $APIURLFILE)
 assert "400" "$out"